@@ -1,48 +1,67 @@
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from database import PasswordUpdateRequest, get_db, User, UserUpdate
-from utils import get_user_by_username, get_password_hash, verify_password
-from oauth import get_current_user
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import PasswordUpdateRequest, get_async_db, Subject, User, UserUpdate
+from utils import get_user_by_username
+from hashing import password_hasher
+from oauth import get_current_user, invalidate_principal
+from roster import invalidate_rosters
 
 adm_users_router = APIRouter()
 
 
 # Eliminar usuario
 @adm_users_router.delete("/delete/{username}", tags=['AdmUsers'])
-def delete_user(username: str, db: Session = Depends(get_db)):
-    user = get_user_by_username(username, db)
+async def delete_user(username: str, db: AsyncSession = Depends(get_async_db)):
+    user = await get_user_by_username(username, db)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    db.delete(user)
-    db.commit()
+    # Como db.delete(user) antes de la sesión async: las materias se conservan sin
+    # profesor (id_maestro NULL) con su historial de asistencias. Se sueltan antes
+    # del DELETE para que el ON DELETE CASCADE de la llave foránea no las borre.
+    result = await db.execute(
+        update(Subject)
+        .where(Subject.id_maestro == user.id)
+        .values(id_maestro=None, version=Subject.version + 1)
+        .returning(Subject.id)
+        .execution_options(synchronize_session=False)
+    )
+    subject_ids = list(result.scalars())
+    await db.execute(delete(User).where(User.id == user.id))
+    await db.commit()
+    invalidate_principal(username)
+    invalidate_rosters(*subject_ids)
     return {"detail": "Usuario eliminado exitosamente"}
 
 # Actualizar usuario por ID
 @adm_users_router.put("/update/me", tags=['AdmUsers'])
-def update_user(updated_user: UserUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    user = db.query(User).filter(User.id == current_user.id).first()
+async def update_user(updated_user: UserUpdate, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    user = await db.get(User, current_user.id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
+    old_usuario = user.usuario
     if updated_user.nombre:
         user.nombre = updated_user.nombre
     if updated_user.usuario:
         user.usuario = updated_user.usuario
-        
-    print("Datos recibidos del cliente:", updated_user.dict())
 
-    db.commit()
+    new_usuario = user.usuario
+    await db.commit()
+    invalidate_principal(old_usuario)
+    invalidate_principal(new_usuario)
     return {"detail": "Usuario actualizado exitosamente"}
 
 # Actualizar contraseña del usuario
 @adm_users_router.put("/update_password", tags=['AdmUsers'])
-def update_password(passwords: PasswordUpdateRequest, 
-                    db: Session = Depends(get_db), 
+async def update_password(passwords: PasswordUpdateRequest, 
+                    db: AsyncSession = Depends(get_async_db), 
                     current_user: User = Depends(get_current_user)):
     
     # Verificar si la contraseña actual es correcta
-    if not verify_password(passwords.current_password, current_user.contraseña):
+    valid, _ = await password_hasher.verify(passwords.current_password, current_user.contraseña)
+    if not valid:
         raise HTTPException(status_code=400, detail="La contraseña actual es incorrecta")
 
     # Verificar si la nueva contraseña y la confirmación coinciden
@@ -50,7 +69,9 @@ def update_password(passwords: PasswordUpdateRequest,
         raise HTTPException(status_code=400, detail="Las nuevas contraseñas no coinciden")
 
     # Actualizar la contraseña
-    current_user.contraseña = get_password_hash(passwords.new_password)
-    db.commit()
+    current_user.contraseña = await password_hasher.hash(passwords.new_password)
+    usuario = current_user.usuario
+    await db.commit()
+    invalidate_principal(usuario)
     
     return {"detail": "Contraseña actualizada exitosamente"}
@@ -0,0 +1,117 @@
+"""Micro-benchmark del middleware de autenticación.
+
+Compara el middleware anterior (``@app.middleware("http")`` sobre
+BaseHTTPMiddleware, que decodifica el JWT, lo descarta e imprime el token)
+contra ``middleware.SessionAuthMiddleware`` (ASGI puro, una sola
+decodificación). En ambos casos el endpoint resuelve el usuario como lo hace
+``get_current_user``: el anterior vuelve a decodificar el token y el nuevo lee
+los claims del scope.
+
+Uso:
+    python benchmarks/bench_auth_middleware.py --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from jose import jwt
+
+from middleware import SessionAuthMiddleware
+from utils import create_access_token, verify_token
+
+
+def build_legacy_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def verify_session(request: Request, call_next):
+        if request.method == "OPTIONS":
+            return await call_next(request)
+        if request.url.path in ["/login", "/register", "/token", "/docs", "/openapi.json"]:
+            return await call_next(request)
+        token = request.cookies.get("token")
+        print(f"Token recibido de la cookie: {token}")
+        if not token:
+            auth_header = request.headers.get("Authorization")
+            print(f"Authorization header recibido: {auth_header}")
+            if auth_header and auth_header.startswith("Bearer "):
+                token = auth_header.split(" ")[1]
+        print(f"Token final después de verificar cookie y header: {token}")
+        if not token:
+            raise HTTPException(status_code=401, detail="No se ha proporcionado el token de acceso.")
+        try:
+            verify_token(token, HTTPException(status_code=401, detail="Token no válido."))
+        except jwt.JWTError:
+            raise HTTPException(status_code=401, detail="Token no válido.")
+        return await call_next(request)
+
+    @app.get("/ping")
+    async def ping(request: Request):
+        token = request.headers["Authorization"].split(" ")[1]
+        return {"usuario": verify_token(token, HTTPException(status_code=401))}
+
+    return app
+
+
+def build_asgi_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(SessionAuthMiddleware)
+
+    @app.get("/ping")
+    async def ping(request: Request):
+        return {"usuario": request.state.auth_claims["sub"]}
+
+    return app
+
+
+async def run(app: FastAPI, total: int, concurrency: int, headers: dict) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Calentamiento
+        for _ in range(50):
+            await client.get("/ping", headers=headers)
+
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                response = await client.get("/ping", headers=headers)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'benchmark'})}"}
+    results = {}
+    # Los print del middleware anterior forman parte de su costo, pero no se muestran
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results["BaseHTTPMiddleware (anterior)"] = asyncio.run(
+            run(build_legacy_app(), args.requests, args.concurrency, headers)
+        )
+        results["SessionAuthMiddleware (ASGI)"] = asyncio.run(
+            run(build_asgi_app(), args.requests, args.concurrency, headers)
+        )
+
+    for name, rps in results.items():
+        print(f"{name:32s} {rps:10.1f} req/s")
+    baseline = results["BaseHTTPMiddleware (anterior)"]
+    print(f"{'Mejora':32s} {results['SessionAuthMiddleware (ASGI)'] / baseline:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Cloudinary simulado para pruebas de carga.
+
+``FakeCloudinaryStorage`` es ``storage.CloudinaryPhotoStorage`` con las
+llamadas al SDK reemplazadas: cada subida, descarga o borrado ocupa un hilo del pool
+durante ``latency`` ± ``jitter`` segundos y puede fallar con probabilidad
+``fail_rate``. Así se mide el efecto real del pool, el semáforo y el timeout
+de la app sin red ni cuenta de Cloudinary.
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import photos
+from faces import FaceModel
+from photos import PhotoManager
+from storage import CloudinaryPhotoStorage
+
+
+class FakeCloudinaryStorage(CloudinaryPhotoStorage):
+    def __init__(
+        self,
+        latency: float = 0.15,
+        jitter: float = 0.05,
+        fail_rate: float = 0.0,
+        seed: int = None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.files = {}
+        self.uploads = 0
+        self.deletes = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _simulate_call(self):
+        with self._lock:
+            delay = max(0.0, self._random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+            fail = self._random.random() < self.fail_rate
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("Fallo simulado de Cloudinary")
+
+    def _upload(self, data: bytes, public_id: str) -> dict:
+        self._simulate_call()
+        with self._lock:
+            self.files.setdefault(public_id, data)
+            self.uploads += 1
+        return {"public_id": public_id, "secure_url": f"https://res.cloudinary.test/{public_id}"}
+
+    def _destroy(self, public_id: str):
+        self._simulate_call()
+        with self._lock:
+            self.files.pop(public_id, None)
+            self.deletes += 1
+        return {"result": "ok"}
+
+    def _fetch(self, public_id: str) -> bytes:
+        self._simulate_call()
+        with self._lock:
+            if public_id not in self.files:
+                raise FileNotFoundError(public_id)
+            return self.files[public_id]
+
+
+def install(storage: FakeCloudinaryStorage, face_model: FaceModel = None) -> PhotoManager:
+    """Hace que get_photo_manager() use ``storage`` (y ``face_model``) en este proceso"""
+    photos.close_photo_manager()
+    photos._photo_manager = PhotoManager(storage, face_model)
+    return photos._photo_manager
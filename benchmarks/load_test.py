@@ -0,0 +1,317 @@
+"""Prueba de carga de los flujos principales con datos sintéticos.
+
+Cada usuario virtual inicia sesión como uno de los profesores generados por
+``synthetic_data.py`` y repite una mezcla ponderada de operaciones sobre sus
+materias hasta agotar ``--duration``:
+
+    login          POST /token
+    lista          GET  /subjects/{id}/enrollments/
+    pase de lista  POST /subjects/{id}/attendance/?upsert=true
+    resumen        GET  /subjects/{id}/attendance/summary
+    historial      GET  /subjects/{id}/attendance/
+    alta alumno    POST /students/ con foto (Cloudinary simulado)
+
+Al final reporta por ruta requests, errores, throughput y latencia p50/p95/p99.
+Por omisión la app corre en este mismo proceso (httpx + ASGITransport) sobre
+``--database-url`` con ``fake_cloudinary.FakeCloudinaryStorage``; con
+``--base-url`` los requests van a un servidor ya levantado (p. ej. uvicorn con
+varios workers sobre un Postgres local) y se usa su backend de fotos.
+
+``--json`` guarda los resultados y ``--baseline`` los compara contra una
+corrida anterior: si el p95 de alguna ruta empeora más de ``--max-regression``
+el proceso termina con código 1, para usarlo antes de desplegar.
+
+Uso:
+    python benchmarks/load_test.py --database-url sqlite:///bench.sqlite --generate --duration 30
+    python benchmarks/load_test.py --database-url postgresql://localhost/bench --generate --teachers 50 --concurrency 40
+    python benchmarks/load_test.py --database-url sqlite:///bench.sqlite --json base.json
+    python benchmarks/load_test.py --database-url sqlite:///bench.sqlite --baseline base.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from PIL import Image
+
+# Los módulos de la app leen DATABASE_URL al importarse: se importan en main()
+
+# Peso de cada operación en la mezcla (el login inicial de cada usuario no cuenta)
+DEFAULT_MIX = "lista=40,pase=15,resumen=20,historial=15,alumno=5,login=5"
+ROUTES = {
+    "login": "POST /token",
+    "lista": "GET /subjects/{id}/enrollments/",
+    "pase": "POST /subjects/{id}/attendance/",
+    "resumen": "GET /subjects/{id}/attendance/summary",
+    "historial": "GET /subjects/{id}/attendance/",
+    "alumno": "POST /students/",
+}
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Operación desconocida: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Percentil por rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.active = False  # Durante el calentamiento no se registra nada
+
+    def record(self, operation: str, elapsed: float, status: int):
+        if not self.active:
+            return
+        self.latencies[operation].append(elapsed)
+        self.statuses[operation][status] += 1
+        if status >= 400:
+            self.errors[operation] += 1
+
+    def results(self, elapsed: float) -> dict:
+        results = {}
+        for operation in ROUTES:
+            values = sorted(self.latencies.get(operation, ()))
+            if not values:
+                continue
+            results[operation] = {
+                "route": ROUTES[operation],
+                "requests": len(values),
+                "errors": self.errors[operation],
+                "throughput": len(values) / elapsed,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+                "statuses": {str(code): count for code, count in sorted(self.statuses[operation].items())},
+            }
+        return results
+
+
+def random_photo(rng: random.Random) -> bytes:
+    """PNG con contenido distinto en cada llamada: cada alta sube una foto nueva"""
+    image = Image.frombytes("RGB", (48, 64), rng.randbytes(48 * 64 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class VirtualUser:
+    def __init__(self, number: int, client: httpx.AsyncClient, recorder: Recorder,
+                 usuario: str, password: str, subject_ids: list, mix: dict, seed: int, run_id: int):
+        self.number = number
+        self.run_id = run_id
+        self.client = client
+        self.recorder = recorder
+        self.usuario = usuario
+        self.password = password
+        self.subject_ids = subject_ids
+        self.rng = random.Random(seed * 1000 + number)
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.headers = {}
+        self.rosters = {}  # id de materia -> ids de alumnos, para armar el pase de lista
+        self.created = itertools.count()
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(operation, time.perf_counter() - start, 599)
+            return None
+        self.recorder.record(operation, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def login(self):
+        response = await self._request(
+            "login", "POST", "/token",
+            data={"username": self.usuario, "password": self.password}
+        )
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def roster(self, subject_id: int):
+        response = await self._request("lista", "GET", f"/subjects/{subject_id}/enrollments/")
+        if response is not None and response.status_code == 200:
+            self.rosters[subject_id] = [student["id"] for student in response.json()]
+
+    async def take_attendance(self, subject_id: int):
+        if subject_id not in self.rosters:
+            await self.roster(subject_id)
+        payload = [
+            {"student_id": student_id, "presente": self.rng.random() < 0.85}
+            for student_id in self.rosters.get(subject_id, ())
+        ]
+        await self._request("pase", "POST", f"/subjects/{subject_id}/attendance/?upsert=true", json=payload)
+
+    async def summary(self, subject_id: int):
+        await self._request("resumen", "GET", f"/subjects/{subject_id}/attendance/summary")
+
+    async def history(self, subject_id: int):
+        await self._request("historial", "GET", f"/subjects/{subject_id}/attendance/")
+
+    async def create_student(self, subject_id: int):
+        # run_id evita chocar con los alumnos creados por corridas anteriores sobre la misma base
+        numero_control = f"LT{self.run_id:05d}{self.number:03d}{next(self.created):06d}"
+        await self._request(
+            "alumno", "POST", "/students/",
+            data={"nombre": "Carga", "apellido": f"Prueba {self.number}", "numero_control": numero_control},
+            files={"photo": ("foto.png", random_photo(self.rng), "image/png")}
+        )
+
+    async def run(self, deadline: float):
+        await self.login()
+        actions = {
+            "login": lambda subject_id: self.login(),
+            "lista": self.roster,
+            "pase": self.take_attendance,
+            "resumen": self.summary,
+            "historial": self.history,
+            "alumno": self.create_student,
+        }
+        while time.perf_counter() < deadline:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            await actions[operation](self.rng.choice(self.subject_ids))
+
+
+async def run_load(client: httpx.AsyncClient, accounts: dict, args) -> dict:
+    if not accounts:
+        raise SystemExit("No hay profesores generados en la base; use --generate")
+    recorder = Recorder()
+    mix = parse_mix(args.mix)
+    run_id = int(time.time()) % 100000
+    # Cada usuario virtual toma un profesor distinto mientras alcancen
+    users = [
+        VirtualUser(number, client, recorder, usuario, args.password, subject_ids, mix, args.seed, run_id)
+        for number, (usuario, subject_ids) in zip(
+            range(args.concurrency), itertools.cycle(sorted(accounts.items()))
+        )
+    ]
+
+    if args.warmup:
+        await asyncio.gather(*(user.run(time.perf_counter() + args.warmup) for user in users))
+    recorder.active = True
+    start = time.perf_counter()
+    await asyncio.gather(*(user.run(start + args.duration) for user in users))
+    return recorder.results(time.perf_counter() - start)
+
+
+def print_results(results: dict):
+    print(f"{'ruta':40s} {'requests':>9s} {'errores':>8s} {'req/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for result in results.values():
+        print(
+            f"{result['route']:40s} {result['requests']:9d} {result['errors']:8d} {result['throughput']:9.1f}"
+            f" {result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f}"
+        )
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """Rutas cuyo p95 empeoró más de ``max_regression`` respecto a la corrida base"""
+    regressions = []
+    for operation, result in results.items():
+        previous = baseline.get(operation)
+        if previous is None or not previous["p95_ms"]:
+            continue
+        change = result["p95_ms"] / previous["p95_ms"] - 1
+        if change > max_regression:
+            regressions.append((result["route"], previous["p95_ms"], result["p95_ms"], change))
+    return regressions
+
+
+def main():
+    # DATABASE_URL tiene que estar fijo antes de importar cualquier módulo de la app
+    database_parser = argparse.ArgumentParser(add_help=False)
+    database_parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench.sqlite"))
+    os.environ["DATABASE_URL"] = database_parser.parse_known_args()[0].database_url
+    import synthetic_data
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], parents=[database_parser])
+    parser.add_argument("--base-url", help="Servidor ya levantado; sin él la app corre en este proceso")
+    parser.add_argument("--generate", action="store_true", help="Genera los datos sintéticos antes de la prueba")
+    parser.add_argument("--duration", type=float, default=30, help="Segundos de medición")
+    parser.add_argument("--warmup", type=float, default=3, help="Segundos de calentamiento sin medir")
+    parser.add_argument("--concurrency", type=int, default=20, help="Usuarios virtuales")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Pesos por operación, p. ej. lista=40,pase=15")
+    parser.add_argument("--cloudinary-latency", type=float, default=0.15, help="Segundos por llamada simulada")
+    parser.add_argument("--cloudinary-jitter", type=float, default=0.05)
+    parser.add_argument("--cloudinary-fail-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--face-model", default="cuadricula",
+        help="Modelo de caras de la app en este proceso; vacío para no calcular embeddings"
+    )
+    parser.add_argument("--json", help="Archivo donde guardar los resultados")
+    parser.add_argument("--baseline", help="Resultados de una corrida anterior (--json) para comparar")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Aumento máximo permitido del p95")
+    synthetic_data.add_arguments(parser)
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    if args.generate:
+        counts = synthetic_data.generate_from_args(args)
+        print("Datos generados: " + ", ".join(f"{rows} {table}" for table, rows in counts.items()))
+    accounts = synthetic_data.load_accounts(args.prefix)
+
+    async def run():
+        if args.base_url:
+            async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+                return await run_load(client, accounts, args)
+
+        import fake_cloudinary
+        from faces import create_face_model
+        from main import create_app
+        from settings import Settings
+
+        # Misma app que en producción, con su lifespan (pools precalentados, cierre limpio)
+        app = create_app(Settings(database_url=args.database_url, photo_backend="fake"))
+        storage = fake_cloudinary.FakeCloudinaryStorage(
+            latency=args.cloudinary_latency,
+            jitter=args.cloudinary_jitter,
+            fail_rate=args.cloudinary_fail_rate,
+            seed=args.seed
+        )
+        async with app.router.lifespan_context(app):
+            fake_cloudinary.install(storage, create_face_model(args.face_model) if args.face_model else None)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                return await run_load(client, accounts, args)
+
+    results = asyncio.run(run())
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for route, previous, current, change in regressions:
+            print(f"Regresión en {route}: p95 {previous:.1f} ms -> {current:.1f} ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Generador de datos sintéticos de una escuela para benchmarks y pruebas de carga.
+
+Crea profesores, materias, alumnos, matrículas y un semestre de asistencias en
+la base de DATABASE_URL (SQLite o Postgres) y reconstruye los resúmenes de
+asistencia. Con la misma semilla y los mismos parámetros los datos son los
+mismos; ``--end-date`` fija también las fechas (por omisión el semestre termina
+ayer, para que el pase de lista de hoy siga libre).
+
+Todos los profesores tienen la misma contraseña, con un solo hash bcrypt
+calculado al inicio (BCRYPT_ROUNDS controla su costo, igual que en la app).
+La base debe estar vacía o al menos no tener datos con el mismo ``--prefix``.
+
+Uso:
+    DATABASE_URL=sqlite:///bench.sqlite python benchmarks/synthetic_data.py --teachers 20 --students 2000
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/synthetic_data.py --weeks 18 --seed 7
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select
+
+import migrations
+from database import Attendance, Enrollment, Student, Subject, User, get_engine
+from hashing import pwd_context
+from summaries import summary_rebuild_statement
+
+DEFAULT_PASSWORD = "benchmark"
+INSERT_CHUNK = 5000
+SUBJECT_NAMES = (
+    "Cálculo", "Álgebra", "Física", "Química", "Programación", "Bases de datos",
+    "Redes", "Estadística", "Inglés", "Ética", "Sistemas operativos", "Electrónica"
+)
+FIRST_NAMES = (
+    "Ana", "Luis", "María", "José", "Sofía", "Carlos", "Valeria", "Jorge", "Fernanda",
+    "Miguel", "Daniela", "Diego", "Camila", "Ricardo", "Paola", "Andrés", "Lucía", "Raúl"
+)
+LAST_NAMES = (
+    "García", "Hernández", "López", "Martínez", "González", "Pérez", "Rodríguez",
+    "Sánchez", "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Reyes"
+)
+SCHEDULES = ("07:00-08:00", "08:00-09:00", "09:00-10:00", "10:00-11:00", "11:00-12:00", "12:00-13:00")
+
+
+def teacher_username(prefix: str, index: int) -> str:
+    return f"{prefix}{index:04d}"
+
+
+def _insert_returning_ids(conn, model, rows: list) -> list:
+    """Inserta por bloques y regresa los ids en el orden de ``rows``"""
+    ids = []
+    for start in range(0, len(rows), INSERT_CHUNK):
+        result = conn.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows[start:start + INSERT_CHUNK]
+        )
+        ids += result.scalars().all()
+    return ids
+
+
+def _class_days(end: date, weeks: int, weekdays: tuple) -> list:
+    start = end - timedelta(weeks=weeks) + timedelta(days=1)
+    return [
+        start + timedelta(days=offset)
+        for offset in range((end - start).days + 1)
+        if (start + timedelta(days=offset)).weekday() in weekdays
+    ]
+
+
+def generate(
+    teachers: int = 10,
+    subjects_per_teacher: int = 4,
+    students: int = 600,
+    students_per_subject: int = 35,
+    weeks: int = 16,
+    days_per_week: int = 2,
+    seed: int = 1,
+    end_date: date = None,
+    prefix: str = "maestro",
+    password: str = DEFAULT_PASSWORD,
+    bind=None
+) -> dict:
+    """Genera los datos y regresa cuántas filas se insertaron por tabla"""
+    bind = bind or get_engine()
+    rng = random.Random(seed)
+    end_date = end_date or date.today() - timedelta(days=1)
+    students_per_subject = min(students_per_subject, students)
+
+    migrations.upgrade(bind)
+    with bind.connect() as conn:
+        if conn.scalar(select(User.id).filter(User.usuario == teacher_username(prefix, 0))) is not None:
+            raise SystemExit(f"Ya hay datos sintéticos con el prefijo '{prefix}'; use una base vacía u otro --prefix")
+
+    password_hash = pwd_context.hash(password)
+    counts = {}
+    with bind.begin() as conn:
+        teacher_ids = _insert_returning_ids(conn, User, [
+            {
+                "nombre": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "usuario": teacher_username(prefix, index),
+                "contraseña": password_hash
+            }
+            for index in range(teachers)
+        ])
+        subject_ids = _insert_returning_ids(conn, Subject, [
+            {
+                "nombre": f"{rng.choice(SUBJECT_NAMES)} {index + 1}",
+                "horario": rng.choice(SCHEDULES),
+                "descripcion": "Materia generada para pruebas de carga",
+                "id_maestro": teacher_id,
+                "version": 1
+            }
+            for teacher_id in teacher_ids
+            for index in range(subjects_per_teacher)
+        ])
+        student_ids = _insert_returning_ids(conn, Student, [
+            {
+                "nombre": rng.choice(FIRST_NAMES),
+                "apellido": f"{rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "numero_control": f"{prefix[:4].upper()}{seed:03d}{index:07d}",
+                "foto_url": f"https://res.cloudinary.test/alumnos/{prefix}-{index}.jpg"
+            }
+            for index in range(students)
+        ])
+
+        # Cada materia toma una muestra de alumnos y tiene sus propios días de clase
+        enrollment_rows = []
+        subject_days = {}
+        for subject_id in subject_ids:
+            for student_id in rng.sample(student_ids, students_per_subject):
+                enrollment_rows.append({"id_alumno": student_id, "id_materia": subject_id})
+            weekdays = tuple(sorted(rng.sample(range(5), min(days_per_week, 5))))
+            subject_days[subject_id] = _class_days(end_date, weeks, weekdays)
+        enrollment_ids = _insert_returning_ids(conn, Enrollment, enrollment_rows)
+
+        # Asistencia por alumno con su propia tasa, para que los reportes no sean uniformes
+        attendance = 0
+        batch = []
+        for enrollment_id, row in zip(enrollment_ids, enrollment_rows):
+            rate = rng.uniform(0.6, 0.98)
+            for day in subject_days[row["id_materia"]]:
+                batch.append({"fecha": day, "presente": rng.random() < rate, "id_matricula": enrollment_id})
+            if len(batch) >= INSERT_CHUNK:
+                conn.execute(insert(Attendance), batch)
+                attendance += len(batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Attendance), batch)
+            attendance += len(batch)
+
+        # Las matrículas recién creadas no tienen resumen: basta con el INSERT ... SELECT
+        if enrollment_ids:
+            conn.execute(summary_rebuild_statement(
+                select(Enrollment.id).filter(Enrollment.id.between(min(enrollment_ids), max(enrollment_ids)))
+            ))
+
+    counts["profesores"] = len(teacher_ids)
+    counts["materias"] = len(subject_ids)
+    counts["alumnos"] = len(student_ids)
+    counts["matriculas"] = len(enrollment_ids)
+    counts["asistencias"] = attendance
+    return counts
+
+
+def load_accounts(prefix: str = "maestro", bind=None) -> dict:
+    """{usuario: [id de materia, ...]} de los profesores generados con ``prefix``"""
+    bind = bind or get_engine()
+    accounts = {}
+    with bind.connect() as conn:
+        rows = conn.execute(
+            select(User.usuario, Subject.id)
+            .join(Subject, Subject.id_maestro == User.id)
+            .filter(User.usuario.like(f"{prefix}%"))
+            .order_by(User.usuario, Subject.id)
+        ).all()
+    for usuario, subject_id in rows:
+        accounts.setdefault(usuario, []).append(subject_id)
+    return accounts
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--teachers", type=int, default=10)
+    parser.add_argument("--subjects-per-teacher", type=int, default=4)
+    parser.add_argument("--students", type=int, default=600)
+    parser.add_argument("--students-per-subject", type=int, default=35)
+    parser.add_argument("--weeks", type=int, default=16, help="Semanas de asistencia hasta --end-date")
+    parser.add_argument("--days-per-week", type=int, default=2, help="Días de clase por semana de cada materia")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None, help="Último día del semestre (AAAA-MM-DD)")
+    parser.add_argument("--prefix", default="maestro", help="Prefijo de los usuarios de los profesores")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+
+
+def generate_from_args(args) -> dict:
+    return generate(
+        teachers=args.teachers,
+        subjects_per_teacher=args.subjects_per_teacher,
+        students=args.students,
+        students_per_subject=args.students_per_subject,
+        weeks=args.weeks,
+        days_per_week=args.days_per_week,
+        seed=args.seed,
+        end_date=args.end_date,
+        prefix=args.prefix,
+        password=args.password
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate_from_args(args)
+    for table, rows in counts.items():
+        print(f"{table:12s} {rows:10d}")
+    print(f"Generado en {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import asyncio
+import csv
+import io
+import itertools
+import mimetypes
+import os
+import posixpath
+import zipfile
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import Headers
+from database import Student, StudentImportReport, StudentImportRow
+from faces import save_embeddings
+from storage import PHOTO_MAX_CONCURRENCY
+
+# Importación masiva de alumnos desde un CSV (numero_control, nombre, apellido)
+# y un ZIP opcional con las fotos nombradas por número de control (p. ej. 2003.jpg).
+# El CSV se lee fila por fila y se procesa en lotes: una consulta para descartar
+# los que ya existen, un INSERT de varias filas y las fotos en paralelo acotado.
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+
+REQUIRED_COLUMNS = ("numero_control", "nombre", "apellido")
+
+
+def _insert_ignore_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT DO NOTHING: si otro request creó el alumno mientras tanto se omite"""
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(Student)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(Student)
+    else:
+        raise NotImplementedError(f"Dialecto no soportado para la importación: {dialect_name}")
+    return stmt.on_conflict_do_nothing(index_elements=[Student.numero_control])\
+        .returning(Student.id, Student.numero_control)
+
+
+def read_photo_index(archive: zipfile.ZipFile) -> dict:
+    """Mapea numero_control -> entrada del ZIP sin descomprimir ninguna foto"""
+    index = {}
+    for info in archive.infolist():
+        if info.is_dir() or info.filename.startswith("__MACOSX/"):
+            continue
+        numero_control = posixpath.splitext(posixpath.basename(info.filename))[0].strip()
+        if numero_control:
+            index.setdefault(numero_control, info)
+    return index
+
+
+def _open_reader(file) -> csv.DictReader:
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    columns = {(name or "").strip().lower() for name in reader.fieldnames or []}
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Faltan columnas en el CSV: {', '.join(missing)}"
+        )
+    return reader
+
+
+def _next_rows(reader: csv.DictReader, count: int) -> list:
+    """Hasta ``count`` filas (línea, fila) siguientes del CSV"""
+    return [
+        (reader.line_num, {
+            (key or "").strip().lower(): (value or "").strip()
+            for key, value in row.items()
+        })
+        for row in itertools.islice(reader, count)
+    ]
+
+
+async def _read_rows(file):
+    """Genera (línea, fila) del CSV sin cargar el archivo completo.
+
+    El archivo subido puede estar en disco y el parseo es síncrono: cada bloque de
+    filas se lee en un hilo para no detener el event loop."""
+    reader = await asyncio.to_thread(_open_reader, file)
+    while True:
+        rows = await asyncio.to_thread(_next_rows, reader, IMPORT_BATCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+async def _upload_photo(photo_manager, semaphore, archive, info):
+    """Regresa ((clave, url, variantes, embedding), error); un fallo en la foto no impide crear al alumno"""
+    if info is None:
+        return None, "No se encontró la foto en el ZIP"
+    async with semaphore:
+        try:
+            content_type = mimetypes.guess_type(info.filename)[0] or "application/octet-stream"
+            # Descomprimir la foto también bloquea: se hace fuera del event loop
+            data = await asyncio.to_thread(archive.read, info)
+            photo = UploadFile(
+                file=io.BytesIO(data),
+                filename=posixpath.basename(info.filename),
+                headers=Headers({"content-type": content_type})
+            )
+            return await photo_manager.store(photo), None
+        except HTTPException as e:
+            return None, e.detail
+        except Exception as e:
+            return None, f"Error al subir la foto: {str(e)}"
+
+
+async def _import_batch(db: AsyncSession, photo_manager, semaphore, archive, photo_index, batch):
+    numeros_control = [data["numero_control"] for _, data in batch]
+
+    # Una sola consulta para todo el lote en lugar de una verificación por alumno
+    existing = set(await db.scalars(
+        select(Student.numero_control).filter(Student.numero_control.in_(numeros_control))
+    ))
+    new_rows = [data for _, data in batch if data["numero_control"] not in existing]
+
+    inserted = {}
+    if new_rows:
+        result = await db.execute(_insert_ignore_statement(db.bind.dialect.name), new_rows)
+        inserted = {numero_control: student_id for student_id, numero_control in result}
+        await db.commit()
+
+    # Solo se guardan las fotos de los alumnos que sí se insertaron
+    photos = {}
+    if archive is not None and inserted:
+        uploads = await asyncio.gather(*(
+            _upload_photo(photo_manager, semaphore, archive, photo_index.get(numero_control))
+            for numero_control in inserted
+        ))
+        photos = dict(zip(inserted, uploads))
+        photo_urls = [
+            {
+                "id": inserted[numero_control],
+                "foto_clave": stored[0],
+                "foto_url": stored[1],
+                "foto_variantes": stored[2]
+            }
+            for numero_control, (stored, _) in photos.items()
+            if stored
+        ]
+        if photo_urls:
+            await db.execute(update(Student), photo_urls)
+            await save_embeddings(db, photo_manager.face_model, {
+                stored[0]: stored[3] for stored, _ in photos.values() if stored
+            })
+            await db.commit()
+
+    results = []
+    for line, data in batch:
+        numero_control = data["numero_control"]
+        if numero_control not in inserted:
+            results.append(StudentImportRow(fila=line, numero_control=numero_control, estado="existente"))
+            continue
+        stored, error = photos.get(numero_control, (None, None))
+        results.append(StudentImportRow(
+            fila=line,
+            numero_control=numero_control,
+            estado="creado",
+            id=inserted[numero_control],
+            foto=stored is not None,
+            error=error
+        ))
+    return results
+
+
+async def import_students(db: AsyncSession, photo_manager, students_file, photos_file=None) -> StudentImportReport:
+    archive = None
+    photo_index = {}
+    if photos_file is not None:
+        try:
+            archive = await asyncio.to_thread(zipfile.ZipFile, photos_file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="El archivo de fotos debe ser un ZIP")
+        photo_index = read_photo_index(archive)
+
+    semaphore = asyncio.Semaphore(PHOTO_MAX_CONCURRENCY)
+    results = []
+    seen = set()
+    batch = []
+    try:
+        async for line, row in _read_rows(students_file):
+            numero_control = row.get("numero_control")
+            if not all(row.get(column) for column in REQUIRED_COLUMNS):
+                results.append(StudentImportRow(
+                    fila=line,
+                    numero_control=numero_control or None,
+                    estado="error",
+                    error="Faltan campos obligatorios"
+                ))
+                continue
+            if numero_control in seen:
+                results.append(StudentImportRow(
+                    fila=line,
+                    numero_control=numero_control,
+                    estado="error",
+                    error="Número de control repetido en el archivo"
+                ))
+                continue
+            seen.add(numero_control)
+            batch.append((line, {column: row[column] for column in REQUIRED_COLUMNS}))
+
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                results.extend(await _import_batch(db, photo_manager, semaphore, archive, photo_index, batch))
+                batch = []
+        if batch:
+            results.extend(await _import_batch(db, photo_manager, semaphore, archive, photo_index, batch))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El CSV debe estar codificado en UTF-8")
+    finally:
+        if archive is not None:
+            archive.close()
+
+    results.sort(key=lambda result: result.fila)
+    return StudentImportReport(
+        creados=sum(result.estado == "creado" for result in results),
+        existentes=sum(result.estado == "existente" for result in results),
+        errores=sum(result.estado == "error" for result in results),
+        resultados=results
+    )
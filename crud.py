@@ -1,122 +1,48 @@
 from datetime import date, datetime
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File,Form
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File,Form
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import Date
-from sqlalchemy.orm import Session
+from sqlalchemy import Date, and_, delete, func, insert, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+import json
 import os
 import shutil
-import cloudinary
-import cloudinary.uploader
 from database import (
-    EnrollmentRequest, User, get_db, Student, Subject, Enrollment, Attendance,
-    StudentCreate, StudentResponse, SubjectCreate, SubjectResponse,
-    EnrollmentCreate, AttendanceCreate, AttendanceResponse, StudentEnrollmentResponse
+    EnrollmentRequest, User, get_async_db, AsyncReadSessionLocal, Student, Subject, Enrollment, Attendance,
+    StudentCreate, StudentResponse,
+    StudentImportReport,
+    SubjectCreate, SubjectResponse,
+    EnrollmentBatchRequest, EnrollmentBatchItem, EnrollmentBatchResponse,
+    EnrollmentCreate, AttendanceCreate, AttendanceItem, AttendanceResponse, StudentEnrollmentResponse,
+    AttendanceSummary, StudentAttendanceSummary,
+    SubjectAttendanceSummary, StudentSubjectAttendanceSummary, ClassPhotoResponse
 )
 from oauth import get_current_user
+from photos import get_photo_manager
+from roster import get_current_roster, get_roster, invalidate_rosters
+from repository import attendance_counts_statement, attendance_history_statement, get_owned_subject
+from faces import prefill_attendance, save_embeddings
+from summaries import apply_attendance_deltas, attendance_percentage
+from pagination import decode_cursor, encode_cursor
+from bulk_import import import_students
+from exports import attendance_matrix_rows, stream_csv, stream_xlsx
+from etags import (
+    bump_student_subjects, bump_subject_version, etag_headers, etag_matches,
+    make_etag, not_modified, subject_etag
+)
 
-#Falta poner porcentaje de asistencia de los alumnos y un indicador de si la materia esta activa.
+#Falta poner un indicador de si la materia esta activa.
 
 crud_router = APIRouter()
 
+# Paginación del historial de asistencias (se puede ajustar por variables de entorno)
+ATTENDANCE_PAGE_SIZE = int(os.getenv("ATTENDANCE_PAGE_SIZE", "1000"))
+ATTENDANCE_MAX_PAGE_SIZE = int(os.getenv("ATTENDANCE_MAX_PAGE_SIZE", "5000"))
+ATTENDANCE_STREAM_BATCH = int(os.getenv("ATTENDANCE_STREAM_BATCH", "500"))
 
 
-class CloudinaryPhotoManager:
-    def __init__(self):
-        cloudinary.config(
-           cloud_name='',
-           api_key='',
-           api_secret=''
-        )
-        self.base_folder = "alumnos"  # Carpeta base para todos los alumnos
-    
-    def get_subject_folder(self, teacher_name: str, subject_name: str) -> str:
-        """Genera el path de la carpeta para una materia específica"""
-        return f"{teacher_name}_{subject_name}"
-    
-    async def upload_student_photo(
-        self,
-        photo: UploadFile,
-        numero_control: str
-    ) -> str:
-        """Sube la foto inicial del estudiante a la carpeta general de alumnos"""
-        if not photo.content_type.startswith("image/"):
-            raise HTTPException(
-                status_code=400,
-                detail="El archivo debe ser una imagen"
-            )
-        
-        try:
-            result = cloudinary.uploader.upload(
-                photo.file,
-                folder=self.base_folder,
-                public_id=numero_control,
-                overwrite=True,
-                format="png"
-            )
-            return result['secure_url']
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al subir la imagen: {str(e)}"
-            )
-    
-    async def copy_to_subject_folder(
-        self,
-        numero_control: str,
-        teacher_name: str,
-        subject_name: str
-    ) -> str:
-        """Copia la foto del estudiante a la carpeta de la materia"""
-        subject_folder = self.get_subject_folder(teacher_name, subject_name)
-        try:
-            # Obtener la imagen de la carpeta general
-            source_url = f"https://res.cloudinary.com/{cloudinary.config().cloud_name}/image/upload/v1/{self.base_folder}/{numero_control}"
-            
-            # Copiar a la carpeta de la materia
-            result = cloudinary.uploader.upload(
-                source_url,
-                folder=f"{self.base_folder}/{subject_folder}",
-                public_id=numero_control,
-                overwrite=True,
-                format="png"
-            )
-            return result['secure_url']
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al copiar la imagen: {str(e)}"
-            )
-    
-    async def delete_from_subject(
-        self,
-        numero_control: str,
-        teacher_name: str,
-        subject_name: str
-    ):
-        """Elimina la foto de un estudiante de una materia específica"""
-        try:
-            subject_folder = self.get_subject_folder(teacher_name, subject_name)
-            cloudinary.uploader.destroy(
-                f"{self.base_folder}/{subject_folder}/{numero_control}"
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al eliminar la imagen: {str(e)}"
-            )
-
-    async def delete_student_photo(self, numero_control: str):
-        """Elimina la foto del estudiante de la carpeta general"""
-        try:
-            cloudinary.uploader.destroy(f"{self.base_folder}/{numero_control}")
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al eliminar la imagen: {str(e)}"
-            )
-            
-        
 
 # Estudiantes
 @crud_router.post("/students/", response_model=StudentResponse, tags=['Students'])
@@ -125,12 +51,12 @@ async def create_student(
     apellido: str = Form(...),
     numero_control: str = Form(...),
     photo: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar si el estudiante ya existe
-    existing_student = db.query(Student).filter(
-        Student.numero_control == numero_control
-    ).first()
+    existing_student = await db.scalar(
+        select(Student).filter(Student.numero_control == numero_control)
+    )
     if existing_student:
         raise HTTPException(
             status_code=400,
@@ -138,43 +64,63 @@ async def create_student(
         )
     
     # Inicializar el gestor de fotos
-    photo_manager = CloudinaryPhotoManager()
+    photo_manager = get_photo_manager()
     
     try:
-        # Subir la foto a la carpeta general de alumnos
-        foto_url = await photo_manager.upload_student_photo(photo, numero_control)
+        # Guardar la foto; si otro alumno ya tiene la misma imagen se reutiliza
+        foto_clave, foto_url, foto_variantes, embedding = await photo_manager.store(photo)
         
         # Crear el estudiante en la base de datos
         new_student = Student(
             nombre=nombre,
             apellido=apellido,
             numero_control=numero_control,
-            foto_url=foto_url
+            foto_url=foto_url,
+            foto_clave=foto_clave,
+            foto_variantes=foto_variantes
         )
         db.add(new_student)
-        db.commit()
-        db.refresh(new_student)
+        # El embedding de la cara se guarda junto con el alumno para el pase de lista por foto
+        await save_embeddings(db, photo_manager.face_model, {foto_clave: embedding})
+        await db.commit()
         
         return new_student
+    except HTTPException:
+        # Errores de la foto (formato, tiempo de espera) se reportan tal cual
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al crear el estudiante: {str(e)}"
         )
 
+@crud_router.post("/students/import", response_model=StudentImportReport, tags=['Students'])
+async def import_students_csv(
+    students: UploadFile = File(...),  # CSV con columnas numero_control, nombre, apellido
+    photos: UploadFile = File(None),  # ZIP con las fotos nombradas por número de control
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await import_students(
+        db,
+        get_photo_manager(),
+        students.file,
+        photos.file if photos else None
+    )
+
 @crud_router.get("/students/", response_model=List[StudentResponse], tags=['Students'])
 async def get_students(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    students = db.query(Student).offset(skip).limit(limit).all()
-    return students
+    students = await db.scalars(select(Student).offset(skip).limit(limit))
+    return students.all()
 
 @crud_router.get("/students/{student_id}", response_model=StudentResponse, tags=['Students'])
-async def get_student(student_id: int, db: Session = Depends(get_db)):
-    student = db.query(Student).filter(Student.id == student_id).first()
+async def get_student(student_id: int, db: AsyncSession = Depends(get_async_db)):
+    student = await db.get(Student, student_id)
     if student is None:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     return student
@@ -182,10 +128,12 @@ async def get_student(student_id: int, db: Session = Depends(get_db)):
 @crud_router.get("/students/by_control/{numero_control}", response_model=StudentResponse, tags=['Students'])
 async def get_student_by_control(
     numero_control: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Buscar al estudiante por número de control
-    student = db.query(Student).filter(Student.numero_control == numero_control).first()
+    student = await db.scalar(
+        select(Student).filter(Student.numero_control == numero_control)
+    )
     if student is None:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     return student
@@ -197,81 +145,74 @@ async def update_student(
     apellido: str = None,
     numero_control: str = None,
     photo: UploadFile = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).filter(Student.id == student_id).first()
+    student = await db.get(Student, student_id)
     if student is None:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
+    old_foto_clave = student.foto_clave
+    old_foto_url = student.foto_url
+    old_foto_variantes = student.foto_variantes or {}
+    old_numero_control = student.numero_control
     if nombre:
         student.nombre = nombre
     if apellido:
         student.apellido = apellido
     if numero_control:
-        # Si se cambia el número de control, hay que actualizar las fotos
-        old_numero_control = student.numero_control
+        # La foto se guarda por contenido, así que cambiar el número de control no la mueve
         student.numero_control = numero_control
     
-    photo_manager = CloudinaryPhotoManager()
+    photo_manager = get_photo_manager()
     
     try:
         if photo:
-            # Eliminar la foto anterior de Cloudinary
-            await photo_manager.delete_student_photo(old_numero_control if numero_control else student.numero_control)
-            
-            # Subir la nueva foto
-            new_foto_url = await photo_manager.upload_student_photo(
-                photo,
-                numero_control if numero_control else student.numero_control
-            )
-            student.foto_url = new_foto_url
-            
-            # Si el estudiante está matriculado en materias, actualizar las fotos en esas materias
-            enrollments = db.query(Enrollment).filter(Enrollment.id_alumno == student_id).all()
-            for enrollment in enrollments:
-                subject = db.query(Subject).filter(Subject.id == enrollment.id_materia).first()
-                teacher = db.query(User).filter(User.id == subject.id_maestro).first()
-                
-                # Eliminar la foto anterior de la carpeta de la materia
-                await photo_manager.delete_from_subject(
-                    old_numero_control if numero_control else student.numero_control,
-                    teacher.nombre,
-                    subject.nombre
-                )
-                
-                # Copiar la nueva foto a la carpeta de la materia
-                new_subject_photo_url = await photo_manager.copy_to_subject_folder(
-                    numero_control if numero_control else student.numero_control,
-                    teacher.nombre,
-                    subject.nombre
-                )
-                enrollment.foto_url = new_subject_photo_url
-        
-        db.commit()
-        db.refresh(student)
-        return student
+            # Las materias muestran la foto_url del alumno: no hay copias que actualizar
+            student.foto_clave, student.foto_url, student.foto_variantes, embedding = await photo_manager.store(photo)
+            await save_embeddings(db, photo_manager.face_model, {student.foto_clave: embedding})
+            # La foto anterior se borra después, y solo si ningún otro alumno la comparte
+            if old_foto_clave and old_foto_clave != student.foto_clave:
+                await photo_manager.release(db, old_foto_clave, old_foto_variantes)
+            elif not old_foto_clave and old_foto_url:
+                await photo_manager.release_legacy(db, student_id, old_numero_control)
         
+        # Los datos del alumno aparecen en las listas de sus materias
+        subject_ids = await bump_student_subjects(db, student_id)
+        await db.commit()
+    except HTTPException:
+        # Errores de la foto (formato, tiempo de espera) se reportan tal cual
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al actualizar el estudiante: {str(e)}"
         )
+    
+    invalidate_rosters(*subject_ids)
+    
+    return student
 
 @crud_router.delete("/students/{student_id}", tags=['Students'])
-async def delete_student(student_id: int, db: Session = Depends(get_db)):
-    student = db.query(Student).filter(Student.id == student_id).first()
+async def delete_student(student_id: int, db: AsyncSession = Depends(get_async_db)):
+    student = await db.get(Student, student_id)
     if student is None:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
-    # Eliminar la foto si existe
-    if student.foto_url:
-        photo_path = os.path.join("static", student.foto_url.lstrip("/static/"))
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
-    
-    db.delete(student)
-    db.commit()
+    # La foto se borra después, y solo si ningún otro alumno la usa; las copias legadas
+    # por materia se buscan antes de que se eliminen las matrículas
+    photo_manager = get_photo_manager()
+    if student.foto_clave:
+        await photo_manager.release(db, student.foto_clave, student.foto_variantes or {})
+    elif student.foto_url:
+        await photo_manager.release_legacy(db, student_id, student.numero_control)
+    
+    # Las matrículas y asistencias se eliminan por ON DELETE CASCADE
+    subject_ids = await bump_student_subjects(db, student_id)
+    await db.execute(delete(Student).where(Student.id == student_id))
+    await db.commit()
+    invalidate_rosters(*subject_ids)
     return {"message": "Estudiante eliminado"}
 
 # Materias
@@ -279,7 +220,7 @@ async def delete_student(student_id: int, db: Session = Depends(get_db)):
 async def create_subject(
     subject: SubjectCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Crear la materia usando los datos del usuario autenticado
     subject_data = subject.dict()
@@ -287,71 +228,80 @@ async def create_subject(
     
     new_subject = Subject(**subject_data)
     db.add(new_subject)
-    db.commit()
-    db.refresh(new_subject)
+    await db.commit()
     return new_subject
 
 
 @crud_router.get("/subjects/{subject_id}/enrollments", response_model=List[StudentEnrollmentResponse], tags=['Enrollments'])
 async def get_subject_enrollments(
     subject_id: int,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
+    # La lista en caché ya trae el dueño; de la base solo la versión de la materia
+    roster = await get_current_roster(db, subject_id, current_user.id)
     
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
-    
-    # Obtener todos los estudiantes matriculados en la materia
-    enrollments = db.query(Enrollment)\
-        .join(Student, Enrollment.id_alumno == Student.id)\
-        .filter(Enrollment.id_materia == subject_id)\
-        .all()
+    # Sin cambios desde la última consulta del cliente
+    etag = subject_etag(request, roster, "matriculas")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(etag_headers(etag))
     
     # Mapear los resultados para incluir los detalles del estudiante
     enrollment_details = [{
-        "numero_control": enrollment.student.numero_control,
-        "nombre": enrollment.student.nombre,
-        "apellido": enrollment.student.apellido
-    } for enrollment in enrollments]
+        "numero_control": student.numero_control,
+        "nombre": student.nombre,
+        "apellido": student.apellido
+    } for student in roster.students]
     
     return enrollment_details
 
 @crud_router.get("/subjects/", response_model=List[SubjectResponse], tags=['Subjects'])
 async def get_subjects(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # Cuántas materias hay, la más reciente y la suma de versiones cambian con
+    # cualquier alta, baja o modificación de las materias del profesor
+    count, max_id, versions = (await db.execute(
+        select(func.count(), func.max(Subject.id), func.sum(Subject.version))
+        .filter(Subject.id_maestro == current_user.id)
+    )).one()
+    etag = make_etag("materias", current_user.id, count, max_id, versions, skip, limit)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(etag_headers(etag))
+    
     # Obtener solo las materias del profesor actual
-    subjects = db.query(Subject)\
-        .filter(Subject.id_maestro == current_user.id)\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    return subjects
+    subjects = await db.scalars(
+        select(Subject)
+        .filter(Subject.id_maestro == current_user.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return subjects.all()
 
 @crud_router.get("/subjects/{subject_id}", response_model=SubjectResponse, tags=['Subjects'])
 async def get_subject(
     subject_id: int,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    if subject is None:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    subject = await get_owned_subject(db, subject_id, current_user.id)
+    
+    etag = subject_etag(request, subject, "materia")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(etag_headers(etag))
     return subject
 
 @crud_router.get("/students/", response_model=List[StudentResponse], tags=['Students'])
@@ -359,38 +309,41 @@ async def get_students(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Obtener los IDs de las materias del profesor
-    teacher_subjects = db.query(Subject.id)\
-        .filter(Subject.id_maestro == current_user.id)\
-        .subquery()
+    teacher_subjects = select(Subject.id)\
+        .filter(Subject.id_maestro == current_user.id)
     
     # Obtener los estudiantes matriculados en las materias del profesor
-    students = db.query(Student)\
-        .join(Enrollment, Student.id == Enrollment.id_alumno)\
-        .filter(Enrollment.id_materia.in_(teacher_subjects))\
-        .distinct()\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    
-    return students
+    students = await db.scalars(
+        select(Student)
+        .join(Enrollment, Student.id == Enrollment.id_alumno)
+        .filter(Enrollment.id_materia.in_(teacher_subjects))
+        .distinct()
+        .offset(skip)
+        .limit(limit)
+    )
+    
+    return students.all()
 
 @crud_router.get("/students/{student_id}", response_model=StudentResponse, tags=['Students'])
 async def get_student(
     student_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que el estudiante esté matriculado en alguna materia del profesor
-    student = db.query(Student)\
-        .join(Enrollment, Student.id == Enrollment.id_alumno)\
-        .join(Subject, Enrollment.id_materia == Subject.id)\
+    student = await db.scalar(
+        select(Student)
+        .join(Enrollment, Student.id == Enrollment.id_alumno)
+        .join(Subject, Enrollment.id_materia == Subject.id)
         .filter(
             Student.id == student_id,
             Subject.id_maestro == current_user.id
-        ).first()
+        )
+        .limit(1)
+    )
     
     if student is None:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
@@ -401,45 +354,34 @@ async def update_subject(
     subject_id: int,
     subject_update: SubjectCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    
-    if subject is None:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    subject = await get_owned_subject(db, subject_id, current_user.id)
     
     # Mantener el id_maestro original
     update_data = subject_update.dict(exclude={'id_maestro'})
     for key, value in update_data.items():
         setattr(subject, key, value)
     
-    db.commit()
-    db.refresh(subject)
+    await bump_subject_version(db, subject_id)
+    await db.commit()
+    invalidate_rosters(subject_id)
     return subject
 
 @crud_router.delete("/subjects/{subject_id}", tags=['Subjects'])
 async def delete_subject(
     subject_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    
-    if subject is None:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    await get_owned_subject(db, subject_id, current_user.id)
     
-    db.delete(subject)
-    db.commit()
+    # Las matrículas y asistencias se eliminan por ON DELETE CASCADE
+    await db.execute(delete(Subject).where(Subject.id == subject_id))
+    await db.commit()
+    invalidate_rosters(subject_id)
     return {"message": "Materia eliminada"}
 
 # Matrículas
@@ -449,224 +391,353 @@ async def create_enrollment(
     subject_id: int,
     enrollment: EnrollmentRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     student_id = enrollment.student_id
     
     # Verificaciones iniciales
-    subject = db.query(Subject).filter(
-        Subject.id == subject_id,
-        Subject.id_maestro == current_user.id
-    ).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
-    
-    student = db.query(Student).filter(Student.id == student_id).first()
+    await get_owned_subject(db, subject_id, current_user.id)
+    
+    student = await db.get(Student, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
-    existing_enrollment = db.query(Enrollment).filter(
-        Enrollment.id_alumno == student_id,
-        Enrollment.id_materia == subject_id
-    ).first()
+    existing_enrollment = await db.scalar(
+        select(Enrollment.id).filter(
+            Enrollment.id_alumno == student_id,
+            Enrollment.id_materia == subject_id
+        )
+    )
     if existing_enrollment:
         raise HTTPException(
             status_code=400,
             detail="El estudiante ya está matriculado en esta materia"
         )
     
-    photo_manager = CloudinaryPhotoManager()
-    
     try:
-        # Copiar la foto a la carpeta de la materia
-        subject_photo_url = await photo_manager.copy_to_subject_folder(
-            student.numero_control,
-            current_user.nombre,
-            subject.nombre
-        )
-        
-        # Crear la matrícula
+        # La foto del alumno se referencia, no se copia: matricular solo escribe la fila
         new_enrollment = Enrollment(
             id_alumno=student_id,
             id_materia=subject_id,
         )
         db.add(new_enrollment)
-        db.commit()
-        db.refresh(new_enrollment)
-        
-        return new_enrollment
+        await bump_subject_version(db, subject_id)
+        await db.commit()
+    except IntegrityError:
+        # Otra petición matriculó al alumno entre la verificación y el commit
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail="El estudiante ya está matriculado en esta materia"
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al crear la matrícula: {str(e)}"
         )
+    invalidate_rosters(subject_id)
+    
+    return {
+        "id": new_enrollment.id,
+        "id_alumno": new_enrollment.id_alumno,
+        "id_materia": new_enrollment.id_materia
+    }
 
-@crud_router.get("/subjects/{subject_id}/enrollments/", tags=['Enrollments'])
-async def get_subject_enrollments(
+@crud_router.post("/subjects/{subject_id}/enrollments/batch", response_model=EnrollmentBatchResponse, tags=['Enrollments'])
+async def create_enrollments_batch(
     subject_id: int,
+    batch: EnrollmentBatchRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    if not batch.student_ids and not batch.numeros_control:
+        raise HTTPException(status_code=400, detail="No se indicaron estudiantes")
     
-    # Obtener los estudiantes matriculados en esta materia
-    enrolled_students = db.query(Student)\
-        .join(Enrollment, Student.id == Enrollment.id_alumno)\
-        .filter(Enrollment.id_materia == subject_id)\
-        .all()
+    await get_owned_subject(db, subject_id, current_user.id)
     
-    return enrolled_students
+    # Una sola consulta: alumnos solicitados y, si existe, su matrícula en esta materia
+    students = (await db.execute(
+        select(Student.id, Student.numero_control, Enrollment.id)
+        .outerjoin(
+            Enrollment,
+            and_(Enrollment.id_alumno == Student.id, Enrollment.id_materia == subject_id)
+        )
+        .filter(or_(
+            Student.id.in_(batch.student_ids),
+            Student.numero_control.in_(batch.numeros_control)
+        ))
+        .order_by(Student.id)
+    )).all()
+    
+    found_ids = {student_id for student_id, _, _ in students}
+    found_numeros_control = {numero_control for _, numero_control, _ in students}
+    already_enrolled = [student_id for student_id, _, enrollment_id in students if enrollment_id is not None]
+    new_students = {
+        student_id: numero_control
+        for student_id, numero_control, enrollment_id in students
+        if enrollment_id is None
+    }
+    
+    enrolled = []
+    if new_students:
+        try:
+            # Todas las matrículas en una transacción
+            result = await db.execute(
+                insert(Enrollment).returning(Enrollment.id, Enrollment.id_alumno),
+                [{"id_alumno": student_id, "id_materia": subject_id} for student_id in new_students]
+            )
+            new_enrollments = result.all()
+            await bump_subject_version(db, subject_id)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail="Otra petición modificó las matrículas de la materia, intenta de nuevo"
+            )
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al crear las matrículas: {str(e)}"
+            )
+        invalidate_rosters(subject_id)
+        
+        enrolled = [
+            EnrollmentBatchItem(
+                id=enrollment_id,
+                id_alumno=student_id,
+                numero_control=new_students[student_id]
+            )
+            for enrollment_id, student_id in new_enrollments
+        ]
+    
+    return EnrollmentBatchResponse(
+        matriculados=enrolled,
+        ya_matriculados=already_enrolled,
+        ids_no_encontrados=sorted(set(batch.student_ids) - found_ids),
+        numeros_control_no_encontrados=sorted(set(batch.numeros_control) - found_numeros_control)
+    )
+
+@crud_router.get("/subjects/{subject_id}/enrollments/", tags=['Enrollments'])
+async def get_subject_enrollments(
+    subject_id: int,
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # La lista en caché ya trae el dueño; de la base solo la versión de la materia
+    roster = await get_current_roster(db, subject_id, current_user.id)
+    
+    etag = subject_etag(request, roster, "alumnos")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(etag_headers(etag))
+    
+    # Mismos campos que las filas de alumnos, sin la matrícula
+    return [
+        {field: value for field, value in student._asdict().items() if field != "id_matricula"}
+        for student in roster.students
+    ]
 
 @crud_router.delete("/subjects/{subject_id}/enrollments/{student_id}", tags=['Enrollments'])
 async def delete_enrollment(
     subject_id: int,
     student_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificaciones
-    subject = db.query(Subject).filter(
-        Subject.id == subject_id,
-        Subject.id_maestro == current_user.id
-    ).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
-    
-    student = db.query(Student).filter(Student.id == student_id).first()
+    await get_owned_subject(db, subject_id, current_user.id)
+    
+    student = await db.get(Student, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
-    enrollment = db.query(Enrollment).filter(
-        Enrollment.id_materia == subject_id,
-        Enrollment.id_alumno == student_id
-    ).first()
+    enrollment = await db.scalar(
+        select(Enrollment).filter(
+            Enrollment.id_materia == subject_id,
+            Enrollment.id_alumno == student_id
+        )
+    )
     if not enrollment:
         raise HTTPException(status_code=404, detail="Matrícula no encontrada")
     
-    photo_manager = CloudinaryPhotoManager()
-    
     try:
-        # Eliminar la foto de la carpeta de la materia
-        await photo_manager.delete_from_subject(
-            student.numero_control,
-            current_user.nombre,
-            subject.nombre
-        )
-        
-        # Eliminar la matrícula
-        db.delete(enrollment)
-        db.commit()
-        
-        return {"message": "Matrícula y foto eliminadas correctamente"}
+        # La materia no tiene copia de la foto: basta con eliminar la matrícula
+        await db.execute(delete(Enrollment).where(Enrollment.id == enrollment.id))
+        await bump_subject_version(db, subject_id)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error al eliminar la matrícula: {str(e)}"
         )
+    invalidate_rosters(subject_id)
+    
+    return {"message": "Matrícula eliminada"}
 
 # Endpoints para asistencias
 @crud_router.post("/subjects/{subject_id}/attendance/", response_model=List[AttendanceResponse], tags=['Attendance'])
 async def create_attendance(
     subject_id: int,
-    attendance_data: List[dict],  # Lista de {student_id: int, presente: bool}
+    attendance_data: List[AttendanceItem],
+    upsert: bool = False,  # Permite reenviar correcciones para la fecha de hoy
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    subject = await get_owned_subject(db, subject_id, current_user.id)
     
-    # Obtener todas las matrículas de la materia con información de alumno
-    enrollments = db.query(Enrollment)\
-        .filter(Enrollment.id_materia == subject_id)\
-        .all()
-    
-    attendance_records = []
     current_date = datetime.now().date()
     
+    # Matrículas de la materia desde la lista en caché; si la versión cambió se vuelve a leer
+    enrollment_ids = (await get_roster(db, subject_id, current_user.id, subject.version)).enrollment_ids
+    
     # Verificar si ya existe registro de asistencia para hoy
-    existing_attendance = db.query(Attendance)\
-        .join(Enrollment)\
+    existing_attendance = await db.scalar(
+        select(Attendance.id)
+        .join(Enrollment)
         .filter(
             Enrollment.id_materia == subject_id,
             Attendance.fecha == current_date
-        ).first()
-    if existing_attendance:
+        )
+        .limit(1)
+    )
+    if existing_attendance and not upsert:
         raise HTTPException(
             status_code=400,
             detail="Ya existe un registro de asistencia para hoy"
         )
     
-    # Crear registros de asistencia
-    for data in attendance_data:
-        student_id = data.get('student_id')
-        
-        # Buscar específicamente la matrícula para este alumno y esta materia
-        enrollment = db.query(Enrollment)\
-            .filter(
-                Enrollment.id_alumno == student_id,
-                Enrollment.id_materia == subject_id
-            ).first()
-        
-        if not enrollment:
+    # Armar las filas a insertar; si un alumno se repite gana el último valor
+    rows = {}
+    for item in attendance_data:
+        enrollment_id = enrollment_ids.get(item.student_id)
+        if enrollment_id is None:
             continue  # Ignorar estudiantes no matriculados
-            
-        attendance = Attendance(
-            fecha=current_date,
-            presente=data.get('presente', False),
-            id_matricula=enrollment.id  # Usar el id de la matrícula encontrada
+        rows[enrollment_id] = {
+            "fecha": current_date,
+            "presente": item.presente,
+            "id_matricula": enrollment_id
+        }
+    
+    if not rows:
+        return []
+    
+    # Deltas para los resúmenes de asistencia: (presentes, total) por matrícula
+    deltas = {
+        enrollment_id: (int(row["presente"]), 1)
+        for enrollment_id, row in rows.items()
+    }
+    
+    # En modo upsert se reemplazan los registros de hoy de los alumnos enviados
+    if existing_attendance:
+        replaced = await db.execute(
+            delete(Attendance)
+            .where(
+                Attendance.id_matricula.in_(list(rows)),
+                Attendance.fecha == current_date
+            )
+            .returning(Attendance.id_matricula, Attendance.presente)
         )
-        db.add(attendance)
-        attendance_records.append(attendance)
+        for enrollment_id, presente in replaced:
+            presentes, total = deltas[enrollment_id]
+            deltas[enrollment_id] = (presentes - int(presente), total - 1)
     
-    db.commit()
-    for record in attendance_records:
-        db.refresh(record)
+    try:
+        # Un solo INSERT de varias filas con RETURNING en lugar de un refresh por registro
+        result = await db.execute(
+            insert(Attendance).returning(
+                Attendance.id,
+                Attendance.fecha,
+                Attendance.presente,
+                Attendance.id_matricula
+            ),
+            list(rows.values())
+        )
+        attendance_records = [record._asdict() for record in result]
+        
+        # Los resúmenes se actualizan en la misma transacción que las asistencias
+        await apply_attendance_deltas(db, deltas)
+        await bump_subject_version(db, subject_id)
+        await db.commit()
+    except IntegrityError:
+        # El índice único (matrícula, fecha) rechazó un registro enviado en paralelo
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail="Ya existe un registro de asistencia para hoy"
+        )
     
     return attendance_records
 
+@crud_router.post("/subjects/{subject_id}/attendance/class-photo", response_model=ClassPhotoResponse, tags=['Attendance'])
+async def match_class_photo(
+    subject_id: int,
+    photo: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Verificar que la materia pertenezca al profesor actual
+    subject = await get_owned_subject(db, subject_id, current_user.id)
+    
+    # Se compara con los embeddings que calculó el mismo modelo al guardar las fotos
+    face_model = get_photo_manager().face_model
+    if face_model is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Modelo de caras no configurado"
+        )
+    
+    if not photo.content_type or not photo.content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=400,
+            detail="El archivo debe ser una imagen"
+        )
+    
+    # Regresa la lista prellenada; la asistencia se registra con create_attendance
+    return await prefill_attendance(db, subject, face_model, await photo.read())
+
+async def _stream_attendance(query):
+    """Genera el historial como NDJSON leyendo por lotes con un cursor del servidor"""
+    # Sesión propia: la del request se cierra antes de que termine el streaming
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=ATTENDANCE_STREAM_BATCH))
+        async for student_id, nombre, apellido, fecha, presente, _ in result:
+            yield json.dumps({
+                "student_id": student_id,
+                "nombre": nombre,
+                "apellido": apellido,
+                "fecha": fecha.isoformat(),
+                "presente": presente
+            }) + "\n"
+
 @crud_router.get("/subjects/{subject_id}/attendance/", tags=['Attendance'])
 async def get_subject_attendance(
     subject_id: int,
+    request: Request,
+    response: Response,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
+    limit: Optional[int] = Query(None, ge=1, le=ATTENDANCE_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,  # Valor de X-Next-Cursor de la página anterior
+    stream: bool = False,  # NDJSON con todas las filas restantes, memoria constante
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Verificar que la materia pertenezca al profesor actual
-    subject = db.query(Subject)\
-        .filter(
-            Subject.id == subject_id,
-            Subject.id_maestro == current_user.id
-        ).first()
-    if not subject:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    subject = await get_owned_subject(db, subject_id, current_user.id)
+    
+    etag = subject_etag(request, subject, "asistencias")
+    if etag_matches(request, etag):
+        return not_modified(etag)
     
     # Construir la consulta base
-    query = db.query(
-        Student.id,
-        Student.nombre,
-        Student.apellido,
-        Attendance.fecha,
-        Attendance.presente
-    )\
-    .join(Enrollment, Student.id == Enrollment.id_alumno)\
-    .join(Attendance, Enrollment.id == Attendance.id_matricula)\
-    .filter(Enrollment.id_materia == subject_id)
+    query = attendance_history_statement(subject_id)
     
     # Aplicar filtros de fecha si se proporcionan
     if start_date:
@@ -674,12 +745,41 @@ async def get_subject_attendance(
     if end_date:
         query = query.filter(Attendance.fecha <= end_date)
     
-    # Ordenar por fecha y nombre del estudiante
-    attendance_records = query.order_by(Attendance.fecha, Student.apellido, Student.nombre).all()
+    # Continuar después de la última fila entregada (keyset)
+    if cursor:
+        query = query.filter(
+            tuple_(Attendance.fecha, Student.apellido, Student.nombre, Attendance.id)
+            > tuple_(*decode_cursor(cursor, date_positions=(0,)))
+        )
+    
+    # Ordenar por fecha y nombre del estudiante; el id desempata para que el cursor sea estable
+    query = query.order_by(Attendance.fecha, Student.apellido, Student.nombre, Attendance.id)
+    
+    if stream:
+        return StreamingResponse(
+            _stream_attendance(query),
+            media_type="application/x-ndjson",
+            headers=etag_headers(etag)
+        )
+    
+    response.headers.update(etag_headers(etag))
+    # Sin limit ni cursor se regresa el historial completo, como antes de paginar;
+    # los clientes que paginan mandan limit o siguen X-Next-Cursor
+    if limit is None and cursor is None:
+        attendance_records = (await db.execute(query)).all()
+    else:
+        limit = limit or ATTENDANCE_PAGE_SIZE
+        attendance_records = (await db.execute(query.limit(limit + 1))).all()
+    
+    # Si hay más filas se indica el cursor de la siguiente página
+    if limit is not None and len(attendance_records) > limit:
+        attendance_records = attendance_records[:limit]
+        _, nombre, apellido, fecha, _, attendance_id = attendance_records[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([fecha, apellido, nombre, attendance_id])
     
     # Organizar los resultados
     results = []
-    for student_id, nombre, apellido, fecha, presente in attendance_records:
+    for student_id, nombre, apellido, fecha, presente, _ in attendance_records:
         results.append({
             "student_id": student_id,
             "nombre": nombre,
@@ -689,3 +789,110 @@ async def get_subject_attendance(
         })
     
     return results
+
+@crud_router.get("/subjects/{subject_id}/attendance/export", tags=['Attendance'])
+async def export_subject_attendance(
+    subject_id: int,
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Verificar que la materia pertenezca al profesor actual
+    await get_owned_subject(db, subject_id, current_user.id)
+    
+    # Matriz alumnos × fechas armada en el servidor y enviada conforme se genera
+    rows = attendance_matrix_rows(subject_id, start_date, end_date)
+    filename = f"asistencias_materia_{subject_id}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "xlsx":
+        return StreamingResponse(
+            stream_xlsx(rows),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers
+        )
+    return StreamingResponse(stream_csv(rows), media_type="text/csv; charset=utf-8", headers=headers)
+
+@crud_router.get("/subjects/{subject_id}/attendance/summary", response_model=SubjectAttendanceSummary, tags=['Attendance'])
+async def get_subject_attendance_summary(
+    subject_id: int,
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Verificar que la materia pertenezca al profesor actual
+    subject = await get_owned_subject(db, subject_id, current_user.id)
+    
+    etag = subject_etag(request, subject, "resumen")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(etag_headers(etag))
+    
+    # Nombres desde la lista en caché; de la base solo los conteos por matrícula
+    roster = await get_roster(db, subject_id, current_user.id, subject.version)
+    counts = {
+        enrollment_id: (presentes, total)
+        for enrollment_id, presentes, total in await db.execute(attendance_counts_statement(subject_id))
+    }
+    
+    students = []
+    subject_presentes = 0
+    subject_total = 0
+    for student in sorted(roster.students, key=lambda student: (student.apellido, student.nombre)):
+        presentes, total = counts.get(student.id_matricula, (0, 0))
+        subject_presentes += presentes
+        subject_total += total
+        students.append(StudentAttendanceSummary(
+            student_id=student.id,
+            numero_control=student.numero_control,
+            nombre=student.nombre,
+            apellido=student.apellido,
+            presentes=presentes,
+            total=total,
+            porcentaje=attendance_percentage(presentes, total)
+        ))
+    
+    return SubjectAttendanceSummary(
+        id_materia=subject.id,
+        nombre=subject.nombre,
+        presentes=subject_presentes,
+        total=subject_total,
+        porcentaje=attendance_percentage(subject_presentes, subject_total),
+        alumnos=students
+    )
+
+@crud_router.get("/students/{student_id}/attendance/summary", response_model=List[StudentSubjectAttendanceSummary], tags=['Attendance'])
+async def get_student_attendance_summary(
+    student_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Solo las materias del profesor actual en las que está matriculado el alumno
+    rows = await db.execute(
+        select(
+            Subject.id,
+            Subject.nombre,
+            func.coalesce(AttendanceSummary.presentes, 0),
+            func.coalesce(AttendanceSummary.total, 0)
+        )
+        .join(Enrollment, Enrollment.id_materia == Subject.id)
+        .outerjoin(AttendanceSummary, AttendanceSummary.id_matricula == Enrollment.id)
+        .filter(
+            Enrollment.id_alumno == student_id,
+            Subject.id_maestro == current_user.id
+        )
+        .order_by(Subject.nombre)
+    )
+    
+    return [
+        StudentSubjectAttendanceSummary(
+            id_materia=subject_id,
+            materia=materia,
+            presentes=presentes,
+            total=total,
+            porcentaje=attendance_percentage(presentes, total)
+        )
+        for subject_id, materia, presentes, total in rows
+    ]
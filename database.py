@@ -1,29 +1,236 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Text
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Text, Index, JSON, LargeBinary
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from pydantic import BaseModel, Field
 from datetime import datetime, date
-from typing import Optional
+from typing import Dict, List, Optional
+from starlette.requests import Request
+import asyncio
+import os
+import time
 
 #DATABASE_URL = ""
-DATABASE_URL = ""
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+# Réplica de solo lectura opcional; si no se configura, las lecturas van al primario
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# Configuración del pool de conexiones (se puede ajustar por variables de entorno)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 = sin límite
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", str(min(DB_POOL_SIZE, 2))))  # Por pool, al arrancar
+
+
+class PoolMetrics:
+    """Tiempo de espera al pedir una conexión al pool (incluye abrir una nueva si hace falta)"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, elapsed: float):
+        self.checkouts += 1
+        self.wait_total += elapsed
+        self.wait_max = max(self.wait_max, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_seconds": self.wait_total / self.checkouts if self.checkouts else 0.0,
+            "wait_max_seconds": self.wait_max,
+            "wait_total_seconds": self.wait_total
+        }
+
+
+def _instrumented_pool_class(base, metrics: PoolMetrics):
+    # Se crea una subclase por engine para que las métricas sobrevivan a pool.recreate()
+    class InstrumentedPool(base):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                metrics.timeouts += 1
+                raise
+            finally:
+                metrics.record(time.perf_counter() - start)
+
+    return InstrumentedPool
+
+
+def _pool_options(url: str, pool_base, metrics: PoolMetrics) -> dict:
+    """Opciones del pool para Postgres; SQLite usa los valores por defecto de SQLAlchemy"""
+    if url.startswith("sqlite"):
+        return {}
+    options = {
+        "poolclass": _instrumented_pool_class(pool_base, metrics),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+    if DB_STATEMENT_TIMEOUT_MS:
+        if "asyncpg" in url:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+pool_metrics = {"primary": PoolMetrics(), "replica": PoolMetrics(), "sync": PoolMetrics()}
+
 Base = declarative_base()
-# Crear la base de datos
-Base.metadata.create_all(bind=engine)
+# Las tablas e índices se crean con `python migrations.py upgrade`
+
+# Los engines se crean con configure_database(): importar este módulo no carga
+# drivers ni arma pools. create_app() los configura en el arranque; los scripts
+# (migraciones, workers, benchmarks) los crean en su primer uso con DATABASE_URL.
+engine = None
+async_engine = None
+async_read_engine = None
+_configured_urls = None  # (síncrona, asíncrona, réplica) de los engines actuales
+
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            configure_database()
+        return super().__call__(**local_kw)
+
+
+# URL equivalente con driver asíncrono: asyncpg para Postgres, aiosqlite para pruebas locales
+def to_async_url(url: str) -> str:
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def _create_async_engine(url: str, metrics: PoolMetrics):
+    async_engine = create_async_engine(url, **_pool_options(url, AsyncAdaptedQueuePool, metrics))
+
+    # SQLite no aplica los ON DELETE CASCADE si no se activan las llaves foráneas
+    if async_engine.dialect.name == "sqlite":
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    return async_engine
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# expire_on_commit=False: en async no se pueden recargar atributos de forma implícita
+AsyncSessionLocal = _LazyAsyncSessionmaker(expire_on_commit=False, autoflush=False)
+AsyncReadSessionLocal = _LazyAsyncSessionmaker(expire_on_commit=False, autoflush=False)
+
+
+def configure_database(
+    database_url: str = None,
+    async_database_url: str = None,
+    replica_url: str = None
+):
+    """Crea los engines y enlaza las sesiones; sin argumentos usa las variables de entorno.
+
+    Sin argumentos reutiliza los engines que ya haya. Si ya hay engines de otras
+    URLs falla: para cambiar de base primero dispose_database()."""
+    global engine, async_engine, async_read_engine, _configured_urls
+    explicit = any(url is not None for url in (database_url, async_database_url, replica_url))
+    database_url = database_url or DATABASE_URL
+    if async_database_url is None:
+        async_database_url = ASYNC_DATABASE_URL if database_url == DATABASE_URL else to_async_url(database_url)
+    replica_url = (replica_url if replica_url is not None else DATABASE_REPLICA_URL) or None
+    if engine is not None:
+        if explicit and (database_url, async_database_url, replica_url) != _configured_urls:
+            raise RuntimeError("La base ya está configurada con otras URLs; llame antes a dispose_database()")
+        return
+    _configured_urls = (database_url, async_database_url, replica_url)
+
+    engine = create_engine(database_url, **_pool_options(database_url, QueuePool, pool_metrics["sync"]))
+    async_engine = _create_async_engine(async_database_url, pool_metrics["primary"])
+    if replica_url:
+        async_read_engine = _create_async_engine(to_async_url(replica_url), pool_metrics["replica"])
+    else:
+        async_read_engine = async_engine
+
+    AsyncSessionLocal.configure(bind=async_engine)
+    AsyncReadSessionLocal.configure(bind=async_read_engine)
+
+
+def get_engine():
+    """Engine síncrono (migraciones y scripts)"""
+    configure_database()
+    return engine
+
+
+async def warm_up_database(connections: int = 1):
+    """Abre ``connections`` conexiones por pool asíncrono antes de aceptar tráfico.
+
+    Se piden a la vez para que el pool conserve conexiones distintas; el primer
+    request no paga el connect ni el handshake de TLS."""
+    configure_database()
+
+    async def ping(db_engine):
+        async with db_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    for db_engine in {id(db_engine): db_engine for db_engine in (async_engine, async_read_engine)}.values():
+        await asyncio.gather(*(ping(db_engine) for _ in range(max(1, connections))))
+
+
+async def dispose_database():
+    """Cierra las conexiones de todos los pools y olvida los engines"""
+    global engine, async_engine, async_read_engine, _configured_urls
+    if engine is None:
+        return
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    await async_engine.dispose()
+    engine.dispose()
+    engine = async_engine = async_read_engine = None
+    _configured_urls = None
+    for session_factory in (AsyncSessionLocal, AsyncReadSessionLocal):
+        session_factory.configure(bind=None)
+
+# Métodos que solo leen: se atienden con la réplica
+READ_ONLY_METHODS = frozenset({"GET", "HEAD"})
+
+# Función para obtener la sesión asíncrona de la base de datos.
+# Los GET (listados, reportes de asistencia) usan la réplica y las escrituras el primario.
+async def get_async_db(request: Request):
+    session_factory = AsyncReadSessionLocal if request.method in READ_ONLY_METHODS else AsyncSessionLocal
+    async with session_factory() as db:
+        yield db
 
-# Crear una sesión de la base de datos
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def pool_engines() -> dict:
+    configure_database()
+    engines = {"primary": async_engine, "sync": engine}
+    if async_read_engine is not async_engine:
+        engines["replica"] = async_read_engine
+    return engines
 
-# Función para obtener la sesión de la base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Estado de los pools y tiempos de espera por checkout
+def pool_stats() -> dict:
+    stats = {}
+    for name, db_engine in pool_engines().items():
+        stats[name] = {"status": db_engine.pool.status(), **pool_metrics[name].stats()}
+    return stats
 
 # Modelos SQLAlchemy
+# Todas las relaciones son lazy="raise": en async una carga perezosa falla de todos
+# modos, y así acceder a una relación sin cargarla en la consulta (joinedload /
+# selectinload) es un error inmediato en lugar de una consulta por fila.
 class User(Base):
     __tablename__ = "usuarios"  # Cambiado para coincidir con el SQL
 
@@ -33,7 +240,7 @@ class User(Base):
     contraseña = Column(String(255), nullable=False)  # Ajustado según SQL
     
     # Relación con materias
-    materias = relationship("Subject", back_populates="maestro")
+    materias = relationship("Subject", back_populates="maestro", lazy="raise", passive_deletes=True)
 
 class Student(Base):
     __tablename__ = "alumnos"  # Cambiado para coincidir con el SQL
@@ -43,9 +250,14 @@ class Student(Base):
     apellido = Column(String(100), nullable=False)
     numero_control = Column(String(20), unique=True, nullable=False)
     foto_url = Column(Text)
+    # Clave de almacenamiento por contenido ("<sha256>.<ext>"); varios alumnos pueden compartirla
+    foto_clave = Column(String(80), index=True)
+    # URLs de las versiones reducidas de la foto, p. ej. {"miniatura": "...", "mediana": "..."}
+    foto_variantes = Column(JSON)
 
-    # Relación con materias a través de matriculas
-    materias = relationship("Subject", secondary="matriculas", back_populates="alumnos")
+    # Relación con materias a través de matriculas (solo lectura: se escribe con Enrollment)
+    materias = relationship("Subject", secondary="matriculas", back_populates="alumnos", viewonly=True, lazy="raise")
+    matriculas = relationship("Enrollment", back_populates="alumno", lazy="raise", passive_deletes=True)
 
 class Subject(Base):
     __tablename__ = "materias"  # Cambiado para coincidir con el SQL
@@ -55,10 +267,18 @@ class Subject(Base):
     horario = Column(String(50))
     descripcion = Column(Text)
     id_maestro = Column(Integer, ForeignKey("usuarios.id", ondelete="CASCADE"))
+    # Se incrementa con cada cambio a la materia, sus matrículas o asistencias (ETags)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Materias del profesor y verificación de propiedad
+        Index("ix_materias_maestro", "id_maestro"),
+    )
 
     # Relaciones
-    maestro = relationship("User", back_populates="materias")
-    alumnos = relationship("Student", secondary="matriculas", back_populates="materias")
+    maestro = relationship("User", back_populates="materias", lazy="raise")
+    alumnos = relationship("Student", secondary="matriculas", back_populates="materias", viewonly=True, lazy="raise")
+    matriculas = relationship("Enrollment", back_populates="materia", lazy="raise", passive_deletes=True)
 
 class Enrollment(Base):
     __tablename__ = "matriculas"  # Cambiado para coincidir con el SQL
@@ -67,8 +287,15 @@ class Enrollment(Base):
     id_alumno = Column(Integer, ForeignKey("alumnos.id", ondelete="CASCADE"))
     id_materia = Column(Integer, ForeignKey("materias.id", ondelete="CASCADE"))
 
-    # Relación con asistencias
-    asistencias = relationship("Attendance", back_populates="matricula")
+    __table_args__ = (
+        # Lista de alumnos por materia; además impide matricular dos veces al mismo alumno
+        Index("ix_matriculas_materia_alumno", "id_materia", "id_alumno", unique=True),
+    )
+
+    # Relaciones con el alumno, la materia y sus asistencias
+    alumno = relationship("Student", back_populates="matriculas", lazy="raise")
+    materia = relationship("Subject", back_populates="matriculas", lazy="raise")
+    asistencias = relationship("Attendance", back_populates="matricula", lazy="raise", passive_deletes=True)
 
 class Attendance(Base):
     __tablename__ = "asistencias"  # Cambiado para coincidir con el SQL
@@ -78,8 +305,37 @@ class Attendance(Base):
     presente = Column(Boolean, nullable=False)
     id_matricula = Column(Integer, ForeignKey("matriculas.id", ondelete="CASCADE"))
 
+    __table_args__ = (
+        # Asistencias por matrícula y rango de fechas; una sola por día
+        Index("ix_asistencias_matricula_fecha", "id_matricula", "fecha", unique=True),
+    )
+
     # Relación con matrícula
-    matricula = relationship("Enrollment", back_populates="asistencias")
+    matricula = relationship("Enrollment", back_populates="asistencias", lazy="raise")
+
+class AttendanceSummary(Base):
+    __tablename__ = "resumen_asistencias"  # Conteos por matrícula, se actualizan junto con asistencias
+
+    id_matricula = Column(Integer, ForeignKey("matriculas.id", ondelete="CASCADE"), primary_key=True)
+    presentes = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+
+class PhotoEmbedding(Base):
+    __tablename__ = "embeddings_fotos"  # Embedding de la cara de cada foto, por modelo
+
+    # Misma clave por contenido que alumnos.foto_clave: alumnos con la misma foto lo comparten
+    foto_clave = Column(String(80), primary_key=True)
+    modelo = Column(String(50), primary_key=True)
+    vector = Column(LargeBinary, nullable=False)  # float32 de norma 1
+
+class PhotoDeletion(Base):
+    __tablename__ = "fotos_por_borrar"  # Archivos que dejaron de usarse; `python photos.py purge --yes` los borra
+
+    # Clave del archivo ("<sha256>[_variante].<ext>") o, en fotos legadas sin foto_clave, su
+    # ruta en Cloudinary bajo alumnos/: "<numero_control>" o "<maestro>_<materia>/<numero_control>"
+    clave = Column(String(255), primary_key=True)
+    foto_clave = Column(String(80))  # Foto a la que pertenece el archivo; NULL en las legadas
+    pedido_en = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 # Modelos Pydantic
 class UserBase(BaseModel):
@@ -108,10 +364,25 @@ class StudentCreate(StudentBase):
 
 class StudentResponse(StudentBase):
     id: int
+    foto_variantes: Optional[Dict[str, str]] = None
 
     class Config:
         orm_mode = True
 
+class StudentImportRow(BaseModel):
+    fila: int  # Número de línea en el CSV (la 1 es el encabezado)
+    numero_control: Optional[str] = None
+    estado: str  # "creado", "existente" o "error"
+    id: Optional[int] = None
+    foto: bool = False
+    error: Optional[str] = None
+
+class StudentImportReport(BaseModel):
+    creados: int
+    existentes: int
+    errores: int
+    resultados: List[StudentImportRow]
+
 class SubjectBase(BaseModel):
     nombre: str
     horario: Optional[str] = None
@@ -139,15 +410,78 @@ class AttendanceCreate(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
+class AttendanceItem(BaseModel):
+    student_id: int
+    presente: bool = False
+
 class AttendanceResponse(AttendanceCreate):
     id: int
 
     class Config:
         orm_mode = True
         
+class StudentAttendanceSummary(BaseModel):
+    student_id: int
+    numero_control: str
+    nombre: str
+    apellido: str
+    presentes: int
+    total: int
+    porcentaje: Optional[float] = None
+
+class SubjectAttendanceSummary(BaseModel):
+    id_materia: int
+    nombre: str
+    presentes: int
+    total: int
+    porcentaje: Optional[float] = None
+    alumnos: List[StudentAttendanceSummary] = []
+
+class StudentSubjectAttendanceSummary(BaseModel):
+    id_materia: int
+    materia: str
+    presentes: int
+    total: int
+    porcentaje: Optional[float] = None
+
 class EnrollmentRequest(BaseModel):
     student_id: int
 
+class EnrollmentBatchRequest(BaseModel):
+    # Se pueden mezclar ids y números de control en la misma petición
+    student_ids: List[int] = []
+    numeros_control: List[str] = []
+
+class EnrollmentBatchItem(BaseModel):
+    id: int
+    id_alumno: int
+    numero_control: str
+
+class EnrollmentBatchResponse(BaseModel):
+    matriculados: List[EnrollmentBatchItem]
+    ya_matriculados: List[int]  # ids de alumnos que ya estaban en la materia
+    ids_no_encontrados: List[int]
+    numeros_control_no_encontrados: List[str]
+
+
+class ClassPhotoStudent(BaseModel):
+    student_id: int
+    numero_control: str
+    nombre: str
+    apellido: str
+    presente: bool = False
+    similitud: Optional[float] = None  # Similitud coseno con la cara asignada
+
+class ClassPhotoResponse(BaseModel):
+    caras_detectadas: int
+    caras_sin_coincidencia: int
+    alumnos_sin_embedding: List[int]  # Alumnos sin foto indexada: se marcan a mano
+    asistencia: List[ClassPhotoStudent]
+
+class SQLProfilingUpdate(BaseModel):
+    enabled: bool
+    slow_ms: Optional[float] = Field(None, ge=0)
+    repeat_threshold: Optional[int] = Field(None, ge=1)
 
 class UserUpdate(BaseModel):
     nombre: str = None
@@ -0,0 +1,67 @@
+import hashlib
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Enrollment, Subject
+
+# GET condicionales para las lecturas por materia.
+# Cada materia tiene un contador `version` que suben las escrituras (matrículas,
+# asistencias, cambios a la materia o a sus alumnos). El ETag se arma con ese
+# contador, así que un GET con If-None-Match vigente responde 304 solo con la
+# verificación de propiedad, sin ejecutar los joins ni serializar la respuesta.
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_headers(etag: str) -> dict:
+    # no-cache: el navegador puede guardar la respuesta pero debe revalidarla siempre
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comparación débil contra If-None-Match (admite lista de ETags y *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+def subject_etag(request: Request, subject: Subject, resource: str) -> str:
+    # La query string forma parte del ETag (rango de fechas, cursor, formato...)
+    return make_etag("materia", subject.id, subject.version, resource, request.url.query)
+
+
+async def bump_subject_version(db: AsyncSession, subject_id: int):
+    """Invalida los ETags de la materia; no confirma la transacción"""
+    await db.execute(
+        update(Subject)
+        .where(Subject.id == subject_id)
+        .values(version=Subject.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bump_student_subjects(db: AsyncSession, student_id: int) -> list:
+    """Invalida los ETags de todas las materias en las que está matriculado el alumno.
+
+    Regresa los ids de esas materias para invalidar sus listas en caché."""
+    result = await db.execute(
+        update(Subject)
+        .where(Subject.id.in_(
+            select(Enrollment.id_materia).filter(Enrollment.id_alumno == student_id)
+        ))
+        .values(version=Subject.version + 1)
+        .returning(Subject.id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
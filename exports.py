@@ -0,0 +1,138 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from typing import Optional
+from sqlalchemy import and_, select
+from database import AsyncReadSessionLocal, Attendance, Enrollment, Student
+from summaries import attendance_percentage
+
+# Exportación de asistencias de una materia como matriz alumnos × fechas.
+# Las filas se arman en una sola pasada ordenada por alumno y fecha, así que en
+# memoria solo vive la fila del alumno actual (más la lista de fechas del encabezado).
+
+EXPORT_STREAM_BATCH = int(os.getenv("EXPORT_STREAM_BATCH", "1000"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+PRESENT_MARK = "P"
+ABSENT_MARK = "A"
+
+FIXED_COLUMNS = ["numero_control", "apellido", "nombre"]
+TOTAL_COLUMNS = ["presentes", "total", "porcentaje"]
+
+
+def _date_filter(start_date: Optional[date], end_date: Optional[date]):
+    conditions = []
+    if start_date:
+        conditions.append(Attendance.fecha >= start_date)
+    if end_date:
+        conditions.append(Attendance.fecha <= end_date)
+    return conditions
+
+
+async def _attendance_dates(db, subject_id: int, start_date=None, end_date=None) -> list:
+    """Fechas con asistencia registrada en la materia (columnas de la matriz)"""
+    result = await db.scalars(
+        select(Attendance.fecha)
+        .join(Enrollment, Enrollment.id == Attendance.id_matricula)
+        .filter(Enrollment.id_materia == subject_id, *_date_filter(start_date, end_date))
+        .distinct()
+        .order_by(Attendance.fecha)
+    )
+    return list(result)
+
+
+async def attendance_matrix_rows(subject_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    """Genera el encabezado y luego una fila por alumno con sus totales acumulados.
+
+    Usa su propia sesión de lectura: cuando se consume el StreamingResponse la
+    sesión del request ya se cerró."""
+    async with AsyncReadSessionLocal() as db:
+        dates = await _attendance_dates(db, subject_id, start_date, end_date)
+        positions = {fecha: index for index, fecha in enumerate(dates)}
+        yield FIXED_COLUMNS + [fecha.isoformat() for fecha in dates] + TOTAL_COLUMNS
+
+        # Outer join para que los alumnos sin asistencias también aparezcan
+        query = select(
+            Student.id,
+            Student.numero_control,
+            Student.apellido,
+            Student.nombre,
+            Attendance.fecha,
+            Attendance.presente
+        )\
+        .join(Enrollment, Student.id == Enrollment.id_alumno)\
+        .outerjoin(
+            Attendance,
+            and_(Attendance.id_matricula == Enrollment.id, *_date_filter(start_date, end_date))
+        )\
+        .filter(Enrollment.id_materia == subject_id)\
+        .order_by(Student.apellido, Student.nombre, Student.id, Attendance.fecha)
+
+        result = await db.stream(query.execution_options(yield_per=EXPORT_STREAM_BATCH))
+
+        current_id = None
+        row = None
+        presentes = total = 0
+        async for student_id, numero_control, apellido, nombre, fecha, presente in result:
+            if student_id != current_id:
+                if row is not None:
+                    yield row + [presentes, total, attendance_percentage(presentes, total)]
+                current_id = student_id
+                row = [numero_control, apellido, nombre] + [""] * len(dates)
+                presentes = total = 0
+            if fecha is None:
+                continue
+            row[len(FIXED_COLUMNS) + positions[fecha]] = PRESENT_MARK if presente else ABSENT_MARK
+            total += 1
+            if presente:
+                presentes += 1
+        if row is not None:
+            yield row + [presentes, total, attendance_percentage(presentes, total)]
+
+
+async def stream_csv(rows):
+    """Convierte las filas en texto CSV, una fila a la vez"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel detecte UTF-8 (acentos en los nombres)
+    yield "\ufeff"
+    async for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+def _append_rows(sheet, rows: list):
+    for row in rows:
+        sheet.append(row)
+
+
+async def stream_xlsx(rows):
+    """Escribe las filas en un libro XLSX en modo write_only y lo envía por bloques.
+
+    openpyxl en modo write_only vuelca cada fila a un archivo temporal, así
+    que la memoria no crece con el número de alumnos. Escribir las filas y
+    comprimir el libro es CPU y disco: se hace en un hilo, por lotes, para
+    no detener el event loop mientras se arma el archivo."""
+    # Importación diferida: openpyxl solo hace falta para esta exportación
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title="Asistencias")
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_STREAM_BATCH:
+            await asyncio.to_thread(_append_rows, sheet, batch)
+            batch = []
+    await asyncio.to_thread(_append_rows, sheet, batch)
+
+    with tempfile.TemporaryFile() as output:
+        await asyncio.to_thread(workbook.save, output)
+        output.seek(0)
+        while chunk := await asyncio.to_thread(output.read, EXPORT_CHUNK_SIZE):
+            yield chunk
@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+from typing import Optional
+import numpy as np
+from PIL import Image
+from sqlalchemy import and_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import TTLCache
+from database import AsyncSessionLocal, ClassPhotoResponse, ClassPhotoStudent, Enrollment, PhotoEmbedding, Student, Subject
+from images import open_image
+
+logger = logging.getLogger(__name__)
+
+# Pase de lista automático con una foto del grupo.
+# El embedding de la cara de cada alumno se calcula una sola vez, al subir su foto, y
+# se guarda en embeddings_fotos con la misma clave por contenido que la foto. Por
+# materia se arma una matriz contigua (alumnos × dimensión) con los de su lista, así
+# comparar todas las caras de la foto del grupo es un solo producto de matrices.
+#
+#   python faces.py reindex   calcula los embeddings que falten para FACE_MODEL (fotos
+#                             subidas antes de configurar el modelo o de cambiarlo)
+
+# Configuración (se puede ajustar por variables de entorno)
+# "modulo:Clase" con un modelo real; "cuadricula" solo para pruebas y benchmarks. Sin
+# modelo no se calculan embeddings y el pase de lista por foto responde 503
+FACE_MODEL = os.getenv("FACE_MODEL", "")
+FACE_MATCH_THRESHOLD = os.getenv("FACE_MATCH_THRESHOLD")  # Por omisión el del modelo
+FACE_INDEX_CACHE_SIZE = int(os.getenv("FACE_INDEX_CACHE_SIZE", "256"))
+FACE_INDEX_CACHE_TTL = float(os.getenv("FACE_INDEX_CACHE_TTL", "600"))
+
+
+class FaceModel:
+    """Interfaz de los modelos de caras.
+
+    ``detect`` regresa un recorte por cara y ``embed`` un arreglo float32
+    (caras × dimension) con filas de norma 1: el producto punto es la similitud coseno."""
+
+    name = ""
+    dimension = 0
+    threshold = 0.5  # Similitud mínima para considerar que dos caras son la misma persona
+
+    def detect(self, image: Image.Image) -> list:
+        raise NotImplementedError
+
+    def embed(self, faces: list) -> np.ndarray:
+        raise NotImplementedError
+
+
+class GridFaceModel(FaceModel):
+    """Modelo determinista en CPU para pruebas y desarrollo.
+
+    No detecta caras de verdad: parte la imagen en cuadros según su proporción (una
+    foto vertical es una cara, una de 4:1 son cuatro) y el embedding son los píxeles
+    en escala de grises a size × size, centrados y normalizados."""
+
+    threshold = 0.9
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self.dimension = size * size
+        self.name = f"cuadricula-{size}"
+
+    def detect(self, image):
+        count = max(1, round(image.width / image.height))
+        step = image.width / count
+        return [
+            image.crop((round(i * step), 0, round((i + 1) * step), image.height))
+            for i in range(count)
+        ]
+
+    def embed(self, faces):
+        if not faces:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        pixels = np.stack([
+            np.asarray(
+                face.convert("L").resize((self.size, self.size), Image.Resampling.BILINEAR),
+                dtype=np.float32
+            ).ravel()
+            for face in faces
+        ])
+        pixels -= pixels.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(pixels, axis=1, keepdims=True)
+        return pixels / np.maximum(norms, 1e-6)
+
+
+def create_face_model(spec: str) -> FaceModel:
+    if spec == "cuadricula":
+        return GridFaceModel()
+    if ":" in spec:
+        # Modelos externos, p. ej. "mi_paquete.caras:ArcFaceModel"
+        module_name, class_name = spec.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)()
+    raise ValueError(f"Modelo de caras desconocido: {spec}")
+
+
+_face_model = None
+
+# Instancia única por proceso: los modelos reales tardan en cargar sus pesos
+def get_face_model() -> Optional[FaceModel]:
+    global _face_model
+    if _face_model is None and FACE_MODEL:
+        _face_model = create_face_model(FACE_MODEL)
+    return _face_model
+
+
+def match_threshold(model: FaceModel) -> float:
+    return float(FACE_MATCH_THRESHOLD) if FACE_MATCH_THRESHOLD else model.threshold
+
+
+def embed_photo(model: FaceModel, data: bytes):
+    """Embedding de la cara más grande de la foto de un alumno, o None si no hay cara"""
+    faces = model.detect(open_image(data))
+    if not faces:
+        return None
+    face = max(faces, key=lambda crop: crop.width * crop.height)
+    return model.embed([face])[0]
+
+
+def embed_faces(model: FaceModel, data: bytes) -> np.ndarray:
+    """Embeddings de todas las caras de una foto del grupo"""
+    return model.embed(model.detect(open_image(data)))
+
+
+def _insert_ignore_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT DO NOTHING: la misma foto pudo indexarse en otro request"""
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(PhotoEmbedding)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(PhotoEmbedding)
+    else:
+        raise NotImplementedError(f"Dialecto no soportado para embeddings: {dialect_name}")
+    return stmt.on_conflict_do_nothing(
+        index_elements=[PhotoEmbedding.foto_clave, PhotoEmbedding.modelo]
+    )
+
+
+async def save_embeddings(db: AsyncSession, model: FaceModel, embeddings: dict):
+    """Guarda {foto_clave: embedding} en la transacción del alumno; no hace commit"""
+    rows = [
+        {
+            "foto_clave": key,
+            "modelo": model.name,
+            "vector": np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+        }
+        for key, embedding in embeddings.items()
+        if embedding is not None
+    ]
+    if rows:
+        await db.execute(_insert_ignore_statement(db.bind.dialect.name), rows)
+
+
+async def reindex_photos(db: AsyncSession, storage, model: FaceModel, after: str = "", limit: int = 100):
+    """Calcula y guarda los embeddings que le faltan a ``model`` para las fotos de alumnos.
+
+    Procesa hasta ``limit`` claves mayores que ``after``, en orden, y hace commit.
+    Regresa (última clave procesada, embeddings guardados); la clave es None cuando
+    ya no quedan fotos. Las fotos que no se pueden leer o sin cara se saltan."""
+    indexed = select(PhotoEmbedding.foto_clave).filter(
+        PhotoEmbedding.foto_clave == Student.foto_clave,
+        PhotoEmbedding.modelo == model.name
+    ).exists()
+    keys = list(await db.scalars(
+        select(Student.foto_clave)
+        .filter(Student.foto_clave > after, ~indexed)
+        .distinct()
+        .order_by(Student.foto_clave)
+        .limit(limit)
+    ))
+    if not keys:
+        return None, 0
+
+    photos = await asyncio.gather(*(storage.read(key) for key in keys), return_exceptions=True)
+    embeddings = {}
+    for key, data in zip(keys, photos):
+        if isinstance(data, Exception):
+            logger.warning("No se pudo leer la foto %s: %s", key, getattr(data, "detail", data))
+            continue
+        try:
+            # Detectar y calcular embeddings es CPU intensivo: se hace fuera del event loop
+            embedding = await asyncio.to_thread(embed_photo, model, data)
+        except Exception as e:
+            logger.warning("No se pudo calcular el embedding de la foto %s: %s", key, e)
+            continue
+        if embedding is not None:
+            embeddings[key] = embedding
+
+    if embeddings:
+        await save_embeddings(db, model, embeddings)
+        # Los índices en caché de las materias de esos alumnos dejan de servir
+        await db.execute(
+            update(Subject)
+            .where(Subject.id.in_(
+                select(Enrollment.id_materia)
+                .join(Student, Student.id == Enrollment.id_alumno)
+                .filter(Student.foto_clave.in_(embeddings))
+            ))
+            .values(version=Subject.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return keys[-1], len(embeddings)
+
+
+class FaceIndex:
+    """Lista de una materia con los embeddings de sus alumnos en una matriz contigua"""
+
+    def __init__(self, roster: list, student_ids: np.ndarray, matrix: np.ndarray):
+        self.roster = roster  # (id, numero_control, nombre, apellido) en orden de lista
+        self.student_ids = student_ids  # id del alumno de cada fila de matrix
+        self.matrix = matrix  # float32 (alumnos con embedding × dimension)
+
+    def match(self, queries: np.ndarray, threshold: float) -> dict:
+        """Asigna cada cara a lo más a un alumno y viceversa; regresa {id_alumno: similitud}"""
+        if not len(queries) or not len(self.student_ids):
+            return {}
+        # Todas las similitudes (caras × alumnos) en una sola multiplicación
+        scores = queries @ self.matrix.T
+        flat = scores.ravel()
+        candidates = np.flatnonzero(flat >= threshold)
+        # Asignación voraz: primero los pares más parecidos
+        candidates = candidates[np.argsort(-flat[candidates], kind="stable")]
+        matched_faces = set()
+        matches = {}
+        for index in candidates:
+            face, column = divmod(int(index), scores.shape[1])
+            student_id = int(self.student_ids[column])
+            if face in matched_faces or student_id in matches:
+                continue
+            matched_faces.add(face)
+            matches[student_id] = float(flat[index])
+        return matches
+
+
+# Índices por (materia, versión, modelo): cualquier cambio a la lista o a las fotos
+# de sus alumnos incrementa Subject.version, así que una entrada nunca queda vieja
+face_index_cache = TTLCache(maxsize=FACE_INDEX_CACHE_SIZE, ttl=FACE_INDEX_CACHE_TTL)
+
+
+async def load_face_index(db: AsyncSession, subject: Subject, model: FaceModel) -> FaceIndex:
+    cache_key = (subject.id, subject.version, model.name)
+    index = face_index_cache.get(cache_key)
+    if index is not None:
+        return index
+
+    rows = (await db.execute(
+        select(
+            Student.id,
+            Student.numero_control,
+            Student.nombre,
+            Student.apellido,
+            PhotoEmbedding.vector
+        )
+        .join(Enrollment, Enrollment.id_alumno == Student.id)
+        .outerjoin(
+            PhotoEmbedding,
+            and_(
+                PhotoEmbedding.foto_clave == Student.foto_clave,
+                PhotoEmbedding.modelo == model.name
+            )
+        )
+        .filter(Enrollment.id_materia == subject.id)
+        .order_by(Student.apellido, Student.nombre, Student.id)
+    )).all()
+
+    indexed = [(row[0], row[4]) for row in rows if row[4] is not None]
+    # Un solo buffer para todos los vectores: la matriz queda contigua sin copias extra
+    matrix = np.frombuffer(
+        b"".join(vector for _, vector in indexed),
+        dtype=np.float32
+    ).reshape(len(indexed), model.dimension)
+    index = FaceIndex(
+        roster=[tuple(row[:4]) for row in rows],
+        student_ids=np.array([student_id for student_id, _ in indexed], dtype=np.int64),
+        matrix=matrix
+    )
+    face_index_cache.set(cache_key, index)
+    return index
+
+
+async def prefill_attendance(db: AsyncSession, subject: Subject, model: FaceModel, data: bytes) -> ClassPhotoResponse:
+    """Lista de la materia con los alumnos reconocidos en la foto marcados como presentes.
+
+    No registra nada: el profesor revisa la lista y la envía a create_attendance."""
+    index = await load_face_index(db, subject, model)
+    # Detectar y calcular embeddings es CPU intensivo: se hace fuera del event loop
+    queries = await asyncio.to_thread(embed_faces, model, data)
+    matches = index.match(queries, match_threshold(model))
+
+    indexed = set(index.student_ids.tolist())
+    return ClassPhotoResponse(
+        caras_detectadas=len(queries),
+        caras_sin_coincidencia=len(queries) - len(matches),
+        alumnos_sin_embedding=[student_id for student_id, *_ in index.roster if student_id not in indexed],
+        asistencia=[
+            ClassPhotoStudent(
+                student_id=student_id,
+                numero_control=numero_control,
+                nombre=nombre,
+                apellido=apellido,
+                presente=student_id in matches,
+                similitud=matches.get(student_id)
+            )
+            for student_id, numero_control, nombre, apellido in index.roster
+        ]
+    )
+
+
+async def _reindex():
+    # Importación diferida: photos importa este módulo
+    from photos import close_photo_manager, get_photo_manager
+
+    photo_manager = get_photo_manager()
+    model = photo_manager.face_model
+    if model is None:
+        close_photo_manager()
+        raise SystemExit("No hay modelo de caras: configura FACE_MODEL")
+    after = ""
+    total = 0
+    try:
+        async with AsyncSessionLocal() as db:
+            while after is not None:
+                after, saved = await reindex_photos(db, photo_manager.storage, model, after)
+                total += saved
+    finally:
+        close_photo_manager()
+    print(f"Embeddings calculados con {model.name}: {total}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embeddings de las fotos de alumnos")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("reindex", help="Calcula los embeddings que falten para FACE_MODEL")
+    args = parser.parse_args()
+
+    if args.command == "reindex":
+        asyncio.run(_reindex())
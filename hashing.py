@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# Este módulo se importa en los procesos del pool: no debe importar la app ni la base de datos
+
+logger = logging.getLogger(__name__)
+
+# Configuración del hashing (se puede ajustar por variables de entorno)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+
+# Configuración para la codificación de contraseñas
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def _hash_password(contraseña: str) -> str:
+    return pwd_context.hash(contraseña)
+
+
+def _verify_password(plain_password: str, hashed_password: str):
+    """Regresa (es_válida, requiere_rehash)"""
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False, False
+    return True, pwd_context.needs_update(hashed_password)
+
+
+class PasswordHasher:
+    """Servicio de hashing en un pool de procesos propio con control de admisión.
+
+    bcrypt es CPU intensivo: se saca del threadpool que atiende los endpoints
+    y, si hay más de ``max_queue`` operaciones en curso, se responde 503 de
+    inmediato en lugar de encolar sin límite."""
+
+    def __init__(self, max_workers: int = HASH_WORKERS, max_queue: int = HASH_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" evita heredar hilos y conexiones abiertas del proceso de la app
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    @staticmethod
+    def _busy() -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, intenta de nuevo en unos segundos",
+            headers={"Retry-After": "1"}
+        )
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        # Un pool roto no se recupera: el siguiente request crea uno nuevo
+        if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, func, *args):
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            raise self._busy()
+        self.in_flight += 1
+        start = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(func, *args))
+        except BrokenProcessPool:
+            # Un proceso del pool murió (p. ej. OOM); este request se reintenta más tarde
+            logger.warning("El pool de hashing se rompió; se recreará en el siguiente request")
+            self._discard_executor(executor)
+            raise self._busy()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            self.completed += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+
+    async def hash(self, contraseña: str) -> str:
+        return await self._submit(_hash_password, contraseña)
+
+    async def verify(self, plain_password: str, hashed_password: str):
+        """Verifica la contraseña; regresa (es_válida, nuevo_hash o None).
+
+        Si el hash se generó con parámetros viejos (p. ej. otro costo de
+        bcrypt) se calcula uno nuevo para que el llamador lo guarde."""
+        valid, needs_update = await self._submit(_verify_password, plain_password, hashed_password)
+        if valid and needs_update:
+            try:
+                return True, await self.hash(plain_password)
+            except HTTPException:
+                # Sin lugar en el pool se omite el re-hash: la contraseña ya se verificó
+                # y el hash viejo se actualiza en otro inicio de sesión
+                return True, None
+        return valid, None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.max_workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_avg_seconds": self.latency_total / self.completed if self.completed else 0.0,
+            "latency_max_seconds": self.latency_max
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,94 @@
+import io
+import os
+from fastapi import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Normalización de fotos al subirlas.
+# Se decodifica la imagen una sola vez, se aplica la orientación EXIF, se descartan
+# los metadatos (EXIF, GPS, perfiles) y se reduce a PHOTO_MAX_DIMENSION. A partir de
+# esa imagen se generan las variantes pequeñas que usan las listas de alumnos.
+
+# Configuración (se puede ajustar por variables de entorno)
+PHOTO_FORMAT = os.getenv("PHOTO_FORMAT", "webp").lower()  # "webp" o "jpeg"
+PHOTO_QUALITY = int(os.getenv("PHOTO_QUALITY", "80"))
+PHOTO_MAX_DIMENSION = int(os.getenv("PHOTO_MAX_DIMENSION", "1024"))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(15 * 1024 * 1024)))
+PHOTO_MAX_PIXELS = int(os.getenv("PHOTO_MAX_PIXELS", str(50_000_000)))
+# Variantes como "nombre:lado_mayor" separadas por comas
+PHOTO_VARIANTS = os.getenv("PHOTO_VARIANTS", "miniatura:96,mediana:320")
+
+_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+
+def parse_variants(spec: str) -> dict:
+    variants = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, size = item.split(":")
+            variants[name.strip()] = int(size)
+    return variants
+
+
+VARIANT_SIZES = parse_variants(PHOTO_VARIANTS)
+
+
+def output_extension() -> str:
+    return _FORMATS[PHOTO_FORMAT][1]
+
+
+def output_content_type() -> str:
+    return _FORMATS[PHOTO_FORMAT][2]
+
+
+def _encode(image: Image.Image) -> bytes:
+    pil_format = _FORMATS[PHOTO_FORMAT][0]
+    buffer = io.BytesIO()
+    # Sin exif ni icc_profile: la salida no lleva metadatos del original
+    if pil_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=PHOTO_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format="WEBP", quality=PHOTO_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def open_image(data: bytes) -> Image.Image:
+    """Decodifica la imagen con la orientación EXIF aplicada y en RGB.
+
+    Valida el tamaño antes de decodificar; es CPU intensivo."""
+    if len(data) > PHOTO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="La imagen es demasiado grande")
+    try:
+        image = Image.open(io.BytesIO(data))
+        # El tamaño se lee del encabezado, antes de decodificar los píxeles
+        if image.width * image.height > PHOTO_MAX_PIXELS:
+            raise HTTPException(status_code=413, detail="La imagen tiene demasiados píxeles")
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise HTTPException(status_code=400, detail="El archivo no es una imagen válida")
+
+    # Las cámaras de teléfono guardan la rotación en EXIF; se aplica antes de descartarlo
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        # Las transparencias se aplanan sobre blanco
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+    return image
+
+
+def normalize_photo(data: bytes) -> dict:
+    """Regresa {"original": bytes, <variante>: bytes, ...} en el formato configurado.
+
+    Es CPU intensivo: se llama desde un hilo, no desde el event loop."""
+    image = open_image(data)
+    image.thumbnail((PHOTO_MAX_DIMENSION, PHOTO_MAX_DIMENSION), Image.Resampling.LANCZOS)
+    outputs = {"original": _encode(image)}
+    for name, size in VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+        outputs[name] = _encode(variant)
+    return outputs
@@ -1,88 +1,142 @@
 import uvicorn
-from fastapi import FastAPI, Request, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt  # Asegúrate de tener jwt importado
 import logging
-from utils import verify_token  # Asegúrate de importar tu función de verificación
+from middleware import SessionAuthMiddleware
+from metrics import MetricsMiddleware, instrument_engines, render_metrics
+from profiling import SQLProfilingMiddleware, require_operator, sql_profiler
 # Importar las rutas
 from session import session_router
 from oauth import oauth_router
 from crud import crud_router
 from fastapi.staticfiles import StaticFiles
 from adm_users import adm_users_router
+from photos import close_photo_manager, open_photo_manager
+from storage import PHOTO_LOCAL_ROOT, PHOTO_LOCAL_URL
+from hashing import password_hasher
+from database import SQLProfilingUpdate, configure_database, dispose_database, pool_stats, warm_up_database
+from oauth import principal_cache
+from roster import roster_cache
+from faces import face_index_cache
+from settings import Settings
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://localhost:8000",
-        "https://retzius-web.vercel.app",
-        "https://regzusapi.onrender.com",
-        "http://127.0.0.1:3000",
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.title = "Asistencia Automatica"
-app.version = "2.0.0"
-
-# Middleware para verificar la sesión
-@app.middleware("http")
-async def verify_session(request: Request, call_next):
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    
-    # Excluye las rutas de login y registro, docs, openapi.json
-    if request.url.path in ["/login", "/register", "/token", "/docs", "/openapi.json"]:
-        return await call_next(request)
-
-    # Intenta obtener el token primero de las cookies
-    token = request.cookies.get("token")
-    print(f"Token recibido de la cookie: {token}")
-
-    # Si no hay token en las cookies, intenta obtenerlo del header Authorization
-    if not token:
-        auth_header = request.headers.get("Authorization")
-        print(f"Authorization header recibido: {auth_header}")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]  # Obtiene el token después de 'Bearer'
-
-    print(f"Token final después de verificar cookie y header: {token}")
-
-    # Si no hay token ni en cookies ni en headers, lanza una excepción
-    if not token:
-        raise HTTPException(status_code=401, detail="No se ha proporcionado el token de acceso.")
-
-    # Verifica el token usando tu función `verify_token`
-    try:
-        username = verify_token(token, HTTPException(status_code=401, detail="Token no válido."))
-    except jwt.JWTError:
-        raise HTTPException(status_code=401, detail="Token no válido.")
-
-    # Si la verificación es exitosa, continúa con la solicitud
-    response = await call_next(request)
-    return response
+home_router = APIRouter()
 
 # Ruta principal (home)
-@app.get("/", tags=['Home'])
+@home_router.get("/", tags=['Home'])
 async def read_root():
     return {"message": "Welcome to the Asistencia Automatica API!"}
 
-# Incluir las rutas
-app.include_router(session_router)
-app.include_router(oauth_router)
-app.include_router(crud_router)
-app.include_router(adm_users_router)
+# Estado de los pools de conexiones a la base de datos
+@home_router.get("/db/stats", tags=['Home'])
+async def db_stats():
+    return pool_stats()
+
+# Perfilado de SQL: se consulta y se activa en caliente durante un incidente
+@home_router.get("/db/profiling", tags=['Home'])
+async def get_sql_profiling():
+    return sql_profiler.status()
+
+@home_router.put("/db/profiling", tags=['Home'], dependencies=[Depends(require_operator)])
+async def update_sql_profiling(update: SQLProfilingUpdate):
+    if update.enabled:
+        sql_profiler.enable(update.slow_ms, update.repeat_threshold)
+    else:
+        sql_profiler.disable()
+    return sql_profiler.status()
+
+# Métricas en formato Prometheus (pública, ver middleware.PUBLIC_PATHS)
+@home_router.get("/metrics", tags=['Home'])
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Aciertos de las cachés en memoria de este proceso
+@home_router.get("/cache/stats", tags=['Home'])
+async def cache_stats():
+    return {
+        "usuarios": principal_cache.stats(),
+        "listas": roster_cache.stats(),
+        "indices_caras": face_index_cache.stats()
+    }
+
+
+def clear_caches():
+    for cache in (principal_cache, roster_cache, face_index_cache):
+        cache.clear()
+
+
+def create_app(settings: Settings = None) -> FastAPI:
+    """Construye la app; la base y las fotos se abren en el lifespan.
+
+    Importar este módulo no conecta a nada: los pools se crean al arrancar, con
+    conexiones ya abiertas antes de aceptar el primer request, y se cierran al apagar."""
+    settings = settings or Settings()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        configure_database(settings.database_url, settings.async_database_url, settings.replica_url)
+        instrument_engines()
+        if settings.sql_profiling:
+            sql_profiler.enable()
+        # Las cachés son del proceso: una app nueva (p. ej. en pruebas) no hereda datos de otra base
+        clear_caches()
+        open_photo_manager(settings.photo_backend)
+        await warm_up_database(settings.warm_connections)
+        logger.info("Aplicación lista")
+        try:
+            yield
+        finally:
+            # Liberar los pools de fotos, de hashing y de la base al apagar
+            close_photo_manager()
+            password_hasher.shutdown()
+            sql_profiler.disable()
+            await dispose_database()
+
+    app = FastAPI(title="Asistencia Automatica", version="2.0.0", lifespan=lifespan)
+
+    # Middleware para verificar la sesión (se agrega antes que CORS para que las
+    # respuestas 401 también lleven los headers de CORS)
+    app.add_middleware(SessionAuthMiddleware)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Sin esto el navegador no deja leer los headers de paginación ni el ETag
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+
+    # Perfilado de SQL por request (sin costo mientras está apagado)
+    app.add_middleware(SQLProfilingMiddleware)
+
+    # Métricas por ruta; es el último que se agrega, así que envuelve a los demás
+    app.add_middleware(MetricsMiddleware)
+
+    # Fotos guardadas en disco por el backend local
+    if settings.photo_backend == "local":
+        app.mount(PHOTO_LOCAL_URL, StaticFiles(directory=PHOTO_LOCAL_ROOT, check_dir=False), name="fotos")
+
+    # Incluir las rutas
+    app.include_router(home_router)
+    app.include_router(session_router)
+    app.include_router(oauth_router)
+    app.include_router(crud_router)
+    app.include_router(adm_users_router)
+    return app
+
+
+# `uvicorn main:app` sigue funcionando; con varios workers conviene
+# `uvicorn main:create_app --factory` para que cada uno construya la suya
+app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:create_app", factory=True, host="0.0.0.0", port=8000)
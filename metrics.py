@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from database import pool_engines, pool_metrics
+
+# Métricas en formato de texto de Prometheus, sin dependencias externas.
+# MetricsMiddleware mide cada request por plantilla de ruta ("/subjects/{subject_id}",
+# no la URL con el id) para que el número de series no crezca con los datos, y
+# cuenta las sentencias SQL que ejecutó el request con un listener del engine.
+# GET /metrics no requiere token (ver middleware.PUBLIC_PATHS).
+
+# Límites de los buckets de latencia en segundos (se puede ajustar por variable de entorno)
+METRICS_LATENCY_BUCKETS = tuple(
+    float(bucket) for bucket in
+    os.getenv("METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")
+)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Ruta para requests que no corresponden a ninguna ruta (404, archivos estáticos)
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            # [conteo por bucket, suma, total]
+            series = self._values.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in sorted(self._values.items())]
+        lines = self._header()
+        for labels, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, labels, [('le', bound)])} {bucket_count}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+http_requests_total = Counter(
+    "http_requests_total", "Requests atendidos por ruta y código de estado",
+    ("method", "route", "status")
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Duración de los requests por ruta, hasta enviar la respuesta completa",
+    ("method", "route")
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress", "Requests en curso",
+    ("method",)
+)
+db_statements_per_request = Histogram(
+    "db_statements_per_request", "Sentencias SQL ejecutadas por request",
+    ("method", "route"), buckets=STATEMENT_BUCKETS
+)
+
+REGISTRY = [
+    http_requests_total,
+    http_request_duration_seconds,
+    http_requests_in_progress,
+    db_statements_per_request,
+]
+
+# Contador de sentencias del request actual; es una lista para que las tareas hijas
+# (p. ej. el generador de un StreamingResponse) sumen sobre el mismo contador
+_request_statements: ContextVar = ContextVar("request_statements", default=None)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def instrument_engines():
+    """Registra el contador de sentencias en todos los engines (una sola vez)"""
+    for db_engine in pool_engines().values():
+        sync_engine = getattr(db_engine, "sync_engine", db_engine)
+        if not event.contains(sync_engine, "before_cursor_execute", _count_statement):
+            event.listen(sync_engine, "before_cursor_execute", _count_statement)
+
+
+def _pool_lines() -> list:
+    """Estado de los pools de conexiones al momento de la consulta"""
+    gauges = {
+        "db_pool_size": ("Conexiones del pool", "size"),
+        "db_pool_checked_out": ("Conexiones en uso", "checkedout"),
+        "db_pool_overflow": ("Conexiones abiertas por encima de pool_size", "overflow"),
+    }
+    lines = []
+    engines = pool_engines()
+    for metric, (documentation, method) in gauges.items():
+        lines += [f"# HELP {metric} {documentation}", f"# TYPE {metric} gauge"]
+        for name, db_engine in engines.items():
+            # SQLite usa pools sin tamaño fijo: solo se reportan los que lo tienen
+            if hasattr(db_engine.pool, method):
+                lines.append(f'{metric}{{pool="{name}"}} {getattr(db_engine.pool, method)()}')
+    counters = {
+        "db_pool_checkouts_total": ("Conexiones pedidas al pool", "checkouts"),
+        "db_pool_timeouts_total": ("Esperas de conexión que agotaron pool_timeout", "timeouts"),
+        "db_pool_wait_seconds_total": ("Tiempo total esperando una conexión del pool", "wait_total"),
+    }
+    for metric, (documentation, attribute) in counters.items():
+        lines += [f"# HELP {metric} {documentation}", f"# TYPE {metric} counter"]
+        for name in engines:
+            lines.append(f'{metric}{{pool="{name}"}} {getattr(pool_metrics[name], attribute)}')
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += _pool_lines()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que registra latencia, código de estado y sentencias SQL por ruta.
+
+    Se agrega al final para que sea el más externo y mida también los 401 del
+    middleware de sesión."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+        statements = [0]
+        token = _request_statements.set(statements)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_progress.dec(method)
+            _request_statements.reset(token)
+            # FastAPI deja la ruta resuelta en el scope; se usa su plantilla, no la URL
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            http_requests_total.inc(method, route, str(status["code"]))
+            http_request_duration_seconds.observe(elapsed, method, route)
+            db_statements_per_request.observe(statements[0], method, route)
@@ -0,0 +1,75 @@
+import logging
+from jose import jwt
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+from storage import PHOTO_LOCAL_URL
+from utils import decode_token
+
+logger = logging.getLogger(__name__)
+
+# Rutas que no requieren token (login, registro, docs, openapi.json, métricas)
+PUBLIC_PATHS = frozenset({"/login", "/register", "/token", "/docs", "/openapi.json", "/metrics"})
+# Prefijos públicos: las fotos locales se usan en <img>, igual que las URLs de Cloudinary
+PUBLIC_PREFIXES = (PHOTO_LOCAL_URL.rstrip("/") + "/",)
+
+
+class SessionAuthMiddleware:
+    """Middleware ASGI que valida el token una sola vez por request.
+
+    Los claims verificados quedan en ``request.state.auth_claims`` para que
+    ``oauth.get_current_user`` no vuelva a decodificar el JWT."""
+
+    def __init__(self, app, public_paths=PUBLIC_PATHS, public_prefixes=PUBLIC_PREFIXES):
+        self.app = app
+        self.public_paths = frozenset(public_paths)
+        self.public_prefixes = tuple(public_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or scope["path"] in self.public_paths
+            or scope["path"].startswith(self.public_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        token = self._get_token(scope)
+        if not token:
+            logger.debug("Request sin token: %s %s", scope["method"], scope["path"])
+            await self._reject("No se ha proporcionado el token de acceso.", scope, receive, send)
+            return
+
+        try:
+            claims = decode_token(token)
+        except jwt.JWTError:
+            logger.info("Token no válido en %s %s", scope["method"], scope["path"])
+            await self._reject("Token no válido.", scope, receive, send)
+            return
+        if claims.get("sub") is None:
+            await self._reject("Token no válido.", scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["auth_claims"] = claims
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _get_token(scope):
+        # Intenta obtener el token primero de las cookies y luego del header Authorization
+        connection = HTTPConnection(scope)
+        token = connection.cookies.get("token")
+        if token:
+            return token
+        auth_header = connection.headers.get("authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            return auth_header[len("Bearer "):]
+        return None
+
+    @staticmethod
+    async def _reject(detail: str, scope, receive, send):
+        response = JSONResponse(
+            status_code=401,
+            content={"detail": detail},
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+        await response(scope, receive, send)
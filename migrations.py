@@ -0,0 +1,299 @@
+import argparse
+import sys
+from datetime import date, datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, delete, insert, inspect, literal, select, text, update
+from database import (
+    Base, get_engine, Attendance, AttendanceSummary, Enrollment, PhotoDeletion, PhotoEmbedding, Student, Subject, User
+)
+from summaries import summary_rebuild_statement
+
+# Migraciones versionadas del esquema.
+# Cada paso corre en su propia transacción, se aplica una sola vez y queda
+# registrado en schema_migrations. Los pasos son idempotentes (checkfirst) para
+# que una base creada desde cero y una que ya existía terminen en el mismo estado.
+#
+#   python migrations.py upgrade   aplica las migraciones pendientes
+#   python migrations.py status    muestra qué versiones están aplicadas
+#   python migrations.py check     verifica con EXPLAIN que las consultas de crud.py usan los índices
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("nombre", String(100), nullable=False),
+    Column("aplicado_en", DateTime, nullable=False)
+)
+
+# Llave del advisory lock de Postgres para que dos despliegues no migren a la vez
+MIGRATION_LOCK_KEY = 725104
+
+MIGRATIONS = []
+
+
+def migration(version: int, nombre: str):
+    def decorator(func):
+        MIGRATIONS.append((version, nombre, func))
+        return func
+    return decorator
+
+
+def create_index_if_missing(conn, model, name: str):
+    """Crea un índice declarado en __table_args__ del modelo si aún no existe"""
+    index = next(index for index in model.__table__.indexes if index.name == name)
+    index.create(bind=conn, checkfirst=True)
+
+
+def add_column_if_missing(conn, model, name: str):
+    """Agrega a una tabla existente una columna declarada en el modelo"""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    if name in existing:
+        return
+    column = table.c[name]
+    ddl = f"{column.type.compile(conn.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl}"))
+
+
+def _rebuild_summaries(conn):
+    """Recalcula resumen_asistencias completo desde asistencias"""
+    conn.execute(delete(AttendanceSummary))
+    conn.execute(summary_rebuild_statement(select(Enrollment.id)))
+
+
+@migration(1, "esquema_inicial")
+def _initial_schema(conn):
+    # Crea solo las tablas que falten; las existentes no se modifican
+    Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+@migration(2, "deduplicar_matriculas_y_asistencias")
+def _deduplicate(conn):
+    # Las asistencias de matrículas repetidas pasan a la matrícula más antigua
+    moved = conn.execute(text("""
+        UPDATE asistencias
+        SET id_matricula = (
+            SELECT MIN(conservada.id)
+            FROM matriculas conservada
+            JOIN matriculas actual
+              ON actual.id_materia = conservada.id_materia
+             AND actual.id_alumno = conservada.id_alumno
+            WHERE actual.id = asistencias.id_matricula
+        )
+        WHERE id_matricula IN (
+            SELECT id FROM matriculas
+            WHERE id_materia IS NOT NULL AND id_alumno IS NOT NULL
+              AND id NOT IN (SELECT MIN(id) FROM matriculas GROUP BY id_materia, id_alumno)
+        )
+    """)).rowcount
+    # Si un alumno tiene dos asistencias el mismo día se conserva la más reciente
+    attendance = conn.execute(text("""
+        DELETE FROM asistencias
+        WHERE id_matricula IS NOT NULL
+          AND id NOT IN (SELECT MAX(id) FROM asistencias GROUP BY id_matricula, fecha)
+    """)).rowcount
+    enrollments = conn.execute(text("""
+        DELETE FROM matriculas
+        WHERE id_materia IS NOT NULL AND id_alumno IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM matriculas GROUP BY id_materia, id_alumno)
+    """)).rowcount
+
+    # resumen_asistencias se acaba de crear en la migración 001: se llena desde
+    # asistencias, ya sin duplicados, haya cambiado algo o no
+    _rebuild_summaries(conn)
+    print(
+        f"  matrículas duplicadas eliminadas: {enrollments}, "
+        f"asistencias movidas: {moved}, asistencias duplicadas eliminadas: {attendance}"
+    )
+
+
+@migration(3, "indices_compuestos")
+def _composite_indexes(conn):
+    create_index_if_missing(conn, Subject, "ix_materias_maestro")
+    create_index_if_missing(conn, Enrollment, "ix_matriculas_materia_alumno")
+    create_index_if_missing(conn, Attendance, "ix_asistencias_matricula_fecha")
+
+
+@migration(4, "version_materias")
+def _subject_version(conn):
+    add_column_if_missing(conn, Subject, "version")
+
+
+@migration(5, "clave_foto_alumnos")
+def _student_photo_key(conn):
+    # Las fotos existentes conservan su foto_url; solo las nuevas llevan clave
+    add_column_if_missing(conn, Student, "foto_clave")
+    create_index_if_missing(conn, Student, "ix_alumnos_foto_clave")
+
+
+@migration(6, "variantes_foto_alumnos")
+def _student_photo_variants(conn):
+    add_column_if_missing(conn, Student, "foto_variantes")
+
+
+@migration(7, "embeddings_fotos")
+def _photo_embeddings(conn):
+    # Las fotos anteriores no tienen embedding hasta que se corre `python faces.py reindex`
+    PhotoEmbedding.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(8, "eliminar_trabajos_fotos")
+def _drop_photo_jobs(conn):
+    # Las materias ya no tienen copias de las fotos, así que el outbox de copiar/eliminar
+    # no tiene nada que hacer; los trabajos que queden sin terminar se descartan.
+    if not inspect(conn).has_table("trabajos_fotos"):
+        return
+    pending = conn.scalar(text("SELECT COUNT(*) FROM trabajos_fotos WHERE estado IN ('pendiente', 'en_proceso')"))
+    if pending:
+        print(f"  Se descartan {pending} trabajos de fotos sin terminar")
+    conn.execute(text("DROP TABLE trabajos_fotos"))
+
+
+@migration(9, "fotos_por_borrar")
+def _photo_deletions(conn):
+    PhotoDeletion.__table__.create(bind=conn, checkfirst=True)
+    # Las listas usan la foto_url del alumno desde la migración 005, así que las copias
+    # por materia de las fotos legadas ya no las usa nadie: se anotan para `photos.py purge`,
+    # que solo las lista hasta que se corre con --yes
+    copies = select(
+        (User.nombre + "_" + Subject.nombre + "/" + Student.numero_control).label("clave"),
+        literal(None, String).label("foto_clave"),
+        literal(datetime.utcnow(), DateTime).label("pedido_en")
+    )\
+        .join(Subject, Subject.id_maestro == User.id)\
+        .join(Enrollment, Enrollment.id_materia == Subject.id)\
+        .join(Student, Student.id == Enrollment.id_alumno)\
+        .filter(Student.foto_clave.is_(None), Student.foto_url.is_not(None))\
+        .distinct()
+    marked = conn.execute(
+        insert(PhotoDeletion).from_select(["clave", "foto_clave", "pedido_en"], copies)
+    ).rowcount
+    print(f"  copias legadas por materia anotadas para borrarse: {marked}")
+
+
+@migration(10, "reconstruir_resumenes_asistencia")
+def _rebuild_attendance_summaries(conn):
+    # Bases que pasaron por la 002 cuando solo reconstruía si había duplicados: sus
+    # resúmenes quedaron vacíos. Los ETags emitidos con esos conteos dejan de servir.
+    _rebuild_summaries(conn)
+    conn.execute(update(Subject).values(version=Subject.version + 1))
+
+
+def _lock(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def applied_versions(conn) -> set:
+    return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def upgrade(bind=None) -> list:
+    """Aplica las migraciones pendientes en orden; regresa las versiones aplicadas"""
+    bind = bind or get_engine()
+    schema_migrations.create(bind=bind, checkfirst=True)
+    applied = []
+    for version, nombre, step in sorted(MIGRATIONS):
+        with bind.begin() as conn:
+            _lock(conn)
+            if version in applied_versions(conn):
+                continue
+            print(f"Aplicando {version:03d}_{nombre}")
+            step(conn)
+            conn.execute(
+                insert(schema_migrations)
+                .values(version=version, nombre=nombre, aplicado_en=datetime.utcnow())
+            )
+        applied.append(version)
+    return applied
+
+
+def status(bind=None) -> list:
+    bind = bind or get_engine()
+    schema_migrations.create(bind=bind, checkfirst=True)
+    with bind.connect() as conn:
+        done = applied_versions(conn)
+    return [(version, nombre, version in done) for version, nombre, _ in sorted(MIGRATIONS)]
+
+
+def index_checks():
+    """Consultas representativas de crud.py y los índices que deben aparecer en su plan"""
+    day = date(2024, 1, 1)
+    return [
+        (
+            "propiedad de la materia",
+            select(Subject.id).filter(Subject.id == 1, Subject.id_maestro == 1),
+            ("ix_materias_maestro", "materias_pkey", "INTEGER PRIMARY KEY")
+        ),
+        (
+            "materias del profesor",
+            select(Subject.id, Subject.nombre).filter(Subject.id_maestro == 1),
+            ("ix_materias_maestro",)
+        ),
+        (
+            "lista de alumnos de la materia",
+            select(Student.id, Student.nombre, Student.apellido)
+            .join(Enrollment, Student.id == Enrollment.id_alumno)
+            .filter(Enrollment.id_materia == 1),
+            ("ix_matriculas_materia_alumno",)
+        ),
+        (
+            "matrícula existente",
+            select(Enrollment.id).filter(Enrollment.id_alumno == 1, Enrollment.id_materia == 1),
+            ("ix_matriculas_materia_alumno",)
+        ),
+        (
+            "asistencias por rango de fechas",
+            select(Student.id, Attendance.fecha, Attendance.presente)
+            .join(Enrollment, Student.id == Enrollment.id_alumno)
+            .join(Attendance, Enrollment.id == Attendance.id_matricula)
+            .filter(Enrollment.id_materia == 1, Attendance.fecha >= day, Attendance.fecha <= day),
+            ("ix_asistencias_matricula_fecha",)
+        ),
+    ]
+
+
+def explain(conn, statement) -> str:
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "postgresql":
+        # Con tablas pequeñas el planner prefiere seq scan; se desactiva para ver si el índice sirve
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        return "\n".join(row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql))
+    if conn.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+    raise NotImplementedError(f"Dialecto no soportado para EXPLAIN: {conn.dialect.name}")
+
+
+def check_indexes(bind=None) -> bool:
+    bind = bind or get_engine()
+    ok = True
+    with bind.begin() as conn:
+        for nombre, statement, expected in index_checks():
+            plan = explain(conn, statement)
+            used = any(index in plan for index in expected)
+            ok = ok and used
+            print(f"[{'OK' if used else 'FALTA'}] {nombre}")
+            if not used:
+                print("    se esperaba: " + ", ".join(expected))
+                print("    " + plan.replace("\n", "\n    "))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    parser.add_argument("command", choices=["upgrade", "status", "check"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = upgrade()
+        print(f"Migraciones aplicadas: {len(applied)}")
+    elif args.command == "status":
+        for version, nombre, done in status():
+            print(f"{version:03d}_{nombre}: {'aplicada' if done else 'pendiente'}")
+    elif args.command == "check":
+        sys.exit(0 if check_indexes() else 1)
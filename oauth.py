@@ -1,29 +1,57 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import timedelta
-from database import get_db, User
-from utils import verify_password, create_access_token, verify_token
+from typing import Optional
+import os
+from cache import TTLCache
+from database import get_async_db, User
+from utils import create_access_token, verify_token
+from hashing import password_hasher
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# auto_error=False: el token también puede llegar por cookie y ya lo validó el middleware
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 oauth_router = APIRouter()
 
 SECRET_KEY = ""
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 7 * 24 * 60 * 60
 
+# Caché de usuarios autenticados, indexada por el "sub" del token
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+def _principal_snapshot(user: User) -> dict:
+    # Se guarda una copia de las columnas, no la instancia ligada a la sesión del request
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def invalidate_principal(usuario: str):
+    """Elimina de la caché al usuario; se llama al modificarlo o eliminarlo"""
+    principal_cache.invalidate(usuario)
+
 @oauth_router.post("/token", tags=['OAUTH&JWT'])
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.usuario == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.contraseña):
+    user = await db.scalar(select(User).filter(User.usuario == form_data.username))
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await password_hasher.verify(form_data.password, user.contraseña)
+    if not valid:
         raise HTTPException(
             status_code=400,
             detail="Nombre de usuario o contraseña incorrectos"
         )
+    if new_hash:
+        # El hash usa parámetros viejos: se guarda con la configuración actual
+        user.contraseña = new_hash
+        await db.commit()
+        invalidate_principal(user.usuario)
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -55,18 +83,35 @@ def login_for_access_token(
     return response
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    request: Request,
+    token: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=401,
         detail="No se pudo validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"}
     )
-    username = verify_token(token, credentials_exception)
-    user = db.query(User).filter(User.usuario == username).first()
+    # Reutilizar los claims que ya verificó SessionAuthMiddleware
+    claims = getattr(request.state, "auth_claims", None)
+    if claims is not None:
+        username = claims["sub"]
+    elif token:
+        username = verify_token(token, credentials_exception)
+    else:
+        raise credentials_exception
+    
+    snapshot = principal_cache.get(username)
+    if snapshot is not None:
+        # Reconstruir el usuario y asociarlo a la sesión actual sin consultar la base
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+    
+    user = await db.scalar(select(User).filter(User.usuario == username))
     if user is None:
         raise credentials_exception
+    principal_cache.set(username, _principal_snapshot(user))
     return user
 
 @oauth_router.get("/users/me", tags=['OAUTH&JWT'])
@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import date
+from fastapi import HTTPException
+
+# Cursores opacos para paginación por keyset: codifican los valores de las
+# columnas de orden de la última fila entregada.
+
+
+def encode_cursor(values) -> str:
+    payload = json.dumps(
+        [value.isoformat() if isinstance(value, date) else value for value in values],
+        separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, date_positions=()) -> list:
+    """Decodifica un cursor; las posiciones indicadas se convierten de vuelta a date"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError("El cursor debe ser una lista")
+        for position in date_positions:
+            values[position] = date.fromisoformat(values[position])
+        return values
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Cursor no válido")
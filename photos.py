@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, Enrollment, PhotoDeletion, PhotoEmbedding, Student, Subject, User
+from faces import FaceModel, embed_photo, get_face_model
+from images import normalize_photo, output_content_type, output_extension
+from storage import PhotoStorage, create_storage
+
+logger = logging.getLogger(__name__)
+
+PHOTO_BACKEND = os.getenv("PHOTO_BACKEND", "cloudinary")  # "cloudinary", "local" o "fake"
+# Las fotos que dejan de usarse se anotan en fotos_por_borrar y `python photos.py purge --yes`
+# (p. ej. desde un cron) las borra pasado este margen, si ningún alumno las volvió a usar.
+# Sin --yes solo lista lo que borraría.
+PHOTO_DELETE_GRACE_SECONDS = float(os.getenv("PHOTO_DELETE_GRACE_SECONDS", "3600"))
+
+
+def variant_key(key: str, name: str) -> str:
+    """Clave de una variante: "<sha256>_<variante>.<ext>" junto a la original"""
+    if name == "original":
+        return key
+    base, extension = key.rsplit(".", 1)
+    return f"{base}_{name}.{extension}"
+
+
+class PhotoManager:
+    """Fotos de alumnos guardadas una sola vez por contenido.
+
+    La clave de almacenamiento es el sha256 de la imagen normalizada, así que dos alumnos
+    con la misma foto comparten el archivo. Las materias no tienen copias: su
+    lista de alumnos usa la misma foto_url, por lo que matricular o dar de baja
+    no toca el almacenamiento. Con un modelo de caras también se calcula el
+    embedding de la foto para el pase de lista automático."""
+
+    def __init__(self, storage: PhotoStorage, face_model: FaceModel = None):
+        self.storage = storage
+        self.face_model = face_model
+
+    def close(self):
+        self.storage.close()
+
+    async def _embed(self, data: bytes):
+        if self.face_model is None:
+            return None
+        try:
+            return await asyncio.to_thread(embed_photo, self.face_model, data)
+        except Exception as e:
+            # Sin embedding el alumno se marca a mano, pero la foto sí se guarda
+            logger.warning("No se pudo calcular el embedding de la foto: %s", e)
+            return None
+
+    async def store(self, photo: UploadFile):
+        """Normaliza y guarda la foto; regresa (clave, url, {variante: url}, embedding)"""
+        if not photo.content_type or not photo.content_type.startswith("image/"):
+            raise HTTPException(
+                status_code=400,
+                detail="El archivo debe ser una imagen"
+            )
+        data = await photo.read()
+        # Decodificar y recomprimir es CPU intensivo: se hace fuera del event loop
+        outputs = await asyncio.to_thread(normalize_photo, data)
+        # La clave es el hash de la imagen ya normalizada, que es lo que se guarda
+        key = f"{hashlib.sha256(outputs['original']).hexdigest()}.{output_extension()}"
+        urls = await asyncio.gather(*(
+            self.storage.save(variant_key(key, name), content, output_content_type())
+            for name, content in outputs.items()
+        ))
+        variants = dict(zip(outputs, urls))
+        embedding = await self._embed(outputs["original"])
+        return key, variants.pop("original"), variants, embedding
+
+    async def release(self, db: AsyncSession, key: str, variants=()):
+        """Anota la foto y sus variantes para borrarse; no hace commit.
+
+        Se llama en la transacción que deja de usar la foto. El archivo no se borra aquí:
+        otro request pudo guardar la misma foto (misma clave) y aún no confirmar su alumno."""
+        if not key:
+            return
+        await _mark_for_deletion(db, [
+            {"clave": variant_key(key, name), "foto_clave": key}
+            for name in ("original", *variants)
+        ])
+
+    async def release_legacy(self, db: AsyncSession, student_id: int, numero_control: str):
+        """Anota la foto legada de un alumno sin foto_clave y sus copias por materia.
+
+        Debe llamarse antes de borrar las matrículas: las copias están en
+        alumnos/<maestro>_<materia>/<numero_control>."""
+        subject_folders = await db.execute(
+            select(User.nombre, Subject.nombre)
+            .join(Subject, Subject.id_maestro == User.id)
+            .join(Enrollment, Enrollment.id_materia == Subject.id)
+            .filter(Enrollment.id_alumno == student_id)
+        )
+        paths = {numero_control}
+        paths.update(f"{teacher}_{subject}/{numero_control}" for teacher, subject in subject_folders)
+        await _mark_for_deletion(db, [{"clave": path, "foto_clave": None} for path in paths])
+
+    async def pending(self, db: AsyncSession, grace_seconds: float = PHOTO_DELETE_GRACE_SECONDS, limit: int = None) -> list:
+        """Archivos que ``purge`` borraría ahora: [(clave, foto_clave)], foto_clave None si es legado"""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        result = await db.execute(
+            select(PhotoDeletion.clave, PhotoDeletion.foto_clave)
+            .filter(PhotoDeletion.pedido_en < cutoff, ~_in_use())
+            .order_by(PhotoDeletion.pedido_en)
+            .limit(limit)
+        )
+        return result.all()
+
+    async def purge(self, db: AsyncSession, grace_seconds: float = PHOTO_DELETE_GRACE_SECONDS, limit: int = 100) -> int:
+        """Borra hasta ``limit`` archivos anotados hace más de ``grace_seconds``; regresa cuántos.
+
+        Si al momento de borrar algún alumno volvió a usar la foto, la anotación se
+        descarta y el archivo se conserva."""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        in_use = _in_use()
+        await db.execute(
+            delete(PhotoDeletion)
+            .where(PhotoDeletion.pedido_en < cutoff, in_use)
+            .execution_options(synchronize_session=False)
+        )
+        due = select(PhotoDeletion.clave).filter(PhotoDeletion.pedido_en < cutoff).limit(limit)
+        result = await db.execute(
+            delete(PhotoDeletion)
+            .where(PhotoDeletion.clave.in_(due), ~in_use)
+            .returning(PhotoDeletion.clave, PhotoDeletion.foto_clave)
+            .execution_options(synchronize_session=False)
+        )
+        rows = result.all()
+        # Se confirma antes de borrar: una foto guardada de nuevo después ya no tiene anotación
+        await db.commit()
+
+        # Justo antes de borrar se vuelve a revisar: un alumno pudo confirmar la misma
+        # foto entre la consulta anterior y ahora, y su archivo no debe desaparecer
+        keys = {foto_clave for _, foto_clave in rows if foto_clave}
+        if keys:
+            reused = set(await db.scalars(
+                select(Student.foto_clave).filter(Student.foto_clave.in_(keys)).distinct()
+            ))
+            rows = [(clave, foto_clave) for clave, foto_clave in rows if foto_clave not in reused]
+
+        outcomes = await asyncio.gather(*(
+            self.storage.delete(clave) if foto_clave else self.storage.delete_legacy(clave)
+            for clave, foto_clave in rows
+        ), return_exceptions=True)
+        failed = []
+        for (clave, foto_clave), outcome in zip(rows, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning("No se pudo eliminar la foto %s: %s", clave, getattr(outcome, "detail", outcome))
+                failed.append({"clave": clave, "foto_clave": foto_clave})
+        # Se vuelven a anotar y se reintentan pasado el margen
+        await _mark_for_deletion(db, failed)
+
+        # El embedding se va con el archivo original, salvo que un alumno ya lo use otra vez
+        originals = [foto_clave for clave, foto_clave in rows if clave == foto_clave]
+        if originals:
+            await db.execute(
+                delete(PhotoEmbedding)
+                .where(
+                    PhotoEmbedding.foto_clave.in_(originals),
+                    ~select(Student.id).filter(Student.foto_clave == PhotoEmbedding.foto_clave).exists()
+                )
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+        return len(rows) - len(failed)
+
+
+def _in_use():
+    """EXISTS de un alumno que usa la foto de la anotación"""
+    return select(Student.id).filter(Student.foto_clave == PhotoDeletion.foto_clave).exists()
+
+
+def _mark_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT que reinicia el margen si el archivo ya estaba anotado"""
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(PhotoDeletion)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(PhotoDeletion)
+    else:
+        raise NotImplementedError(f"Dialecto no soportado para fotos por borrar: {dialect_name}")
+    return stmt.on_conflict_do_update(
+        index_elements=[PhotoDeletion.clave],
+        set_={"pedido_en": stmt.excluded.pedido_en}
+    )
+
+
+async def _mark_for_deletion(db: AsyncSession, rows: list):
+    if rows:
+        now = datetime.utcnow()
+        await db.execute(
+            _mark_statement(db.bind.dialect.name),
+            [{**row, "pedido_en": now} for row in rows]
+        )
+
+_photo_manager = None
+
+# Instancia única por proceso: evita reconfigurar el backend en cada request
+def get_photo_manager() -> PhotoManager:
+    global _photo_manager
+    if _photo_manager is None:
+        _photo_manager = PhotoManager(create_storage(PHOTO_BACKEND), get_face_model())
+    return _photo_manager
+
+
+def open_photo_manager(backend: str = PHOTO_BACKEND) -> PhotoManager:
+    """Crea el gestor con ``backend`` en el arranque de la app, no en el primer request"""
+    global _photo_manager
+    close_photo_manager()
+    _photo_manager = PhotoManager(create_storage(backend), get_face_model())
+    return _photo_manager
+
+
+def close_photo_manager():
+    global _photo_manager
+    if _photo_manager is not None:
+        _photo_manager.close()
+        _photo_manager = None
+
+
+async def _purge(grace_seconds: float, confirm: bool):
+    photo_manager = get_photo_manager()
+    total = 0
+    try:
+        async with AsyncSessionLocal() as db:
+            if not confirm:
+                # Sin confirmación solo se lista: los archivos legados viven en Cloudinary
+                # y no se pueden recuperar una vez borrados
+                rows = await photo_manager.pending(db, grace_seconds)
+                for clave, foto_clave in rows:
+                    print(f"  {clave}{'' if foto_clave else ' (legada)'}")
+                print(f"Fotos por borrar: {len(rows)}. Usa --yes para borrarlas.")
+                return
+            while await photo_manager.pending(db, grace_seconds, limit=1):
+                total += await photo_manager.purge(db, grace_seconds)
+    finally:
+        close_photo_manager()
+    print(f"Fotos eliminadas: {total}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de las fotos de alumnos")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    purge_parser = subparsers.add_parser("purge", help="Lista o borra las fotos que ya ningún alumno usa")
+    purge_parser.add_argument(
+        "--grace-seconds", type=float, default=PHOTO_DELETE_GRACE_SECONDS,
+        help="Solo las anotadas hace más de este tiempo"
+    )
+    purge_parser.add_argument(
+        "--yes", action="store_true",
+        help="Borra los archivos; sin esta opción solo se listan"
+    )
+    args = parser.parse_args()
+
+    if args.command == "purge":
+        asyncio.run(_purge(args.grace_seconds, args.yes))
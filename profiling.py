@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+import secrets
+import time
+from collections import Counter
+from contextvars import ContextVar
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from database import pool_engines
+
+logger = logging.getLogger(__name__)
+
+# Perfilado de SQL para diagnosticar incidentes en producción.
+# Mientras está activo, cada sentencia se cronometra y se atribuye al request en
+# curso: las que pasan de SQL_SLOW_MS se registran con sus parámetros y, al terminar
+# el request, se avisa si una misma forma de sentencia se ejecutó más de
+# SQL_REPEAT_THRESHOLD veces (el patrón N+1 de una consulta por alumno).
+# Apagado no hay listeners registrados en los engines, así que no cuesta nada.
+# Se activa con SQL_PROFILING=1 o en caliente con PUT /db/profiling (solo en el
+# proceso que atiende la petición). Esa ruta pide el header X-Operator-Token con el
+# valor de OPERATOR_TOKEN; sin OPERATOR_TOKEN queda deshabilitada.
+
+SQL_PROFILING = os.getenv("SQL_PROFILING", "false").lower() in ("1", "true", "yes")
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+SQL_LOG_PARAMS_CHARS = 500
+OPERATOR_TOKEN = os.getenv("OPERATOR_TOKEN", "")
+
+# Listas de parámetros de IN expandidas: "(?, ?, ?)" y "($1, $2)" cuentan como la misma forma
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|\$\d+|%\(\w+\)s)(?:\s*,\s*(?:\?|\$\d+|%\(\w+\)s))+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def require_operator(x_operator_token: str = Header(None)):
+    """Dependencia de las rutas que cambian el comportamiento del proceso"""
+    if not OPERATOR_TOKEN or not x_operator_token or not secrets.compare_digest(x_operator_token, OPERATOR_TOKEN):
+        raise HTTPException(status_code=403, detail="Se requiere el token de operador")
+
+
+def statement_shape(statement: str) -> str:
+    return _PARAM_LIST.sub("(...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class RequestProfile:
+    __slots__ = ("statements", "elapsed", "shapes")
+
+    def __init__(self):
+        self.statements = 0
+        self.elapsed = 0.0
+        self.shapes = Counter()
+
+
+_current_profile: ContextVar = ContextVar("sql_profile", default=None)
+
+
+class SQLProfiler:
+    def __init__(self, slow_ms: float = SQL_SLOW_MS, repeat_threshold: int = SQL_REPEAT_THRESHOLD):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self.slow_statements = 0
+        self.repeated_requests = 0
+
+    # El inicio se guarda en el contexto de ejecución de la sentencia: si la
+    # sentencia falla o el perfilado se apaga a la mitad, se descarta con él
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start_time = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start_time", None)
+        if start is None:
+            # El perfilado se activó a mitad de la sentencia
+            return
+        elapsed = time.perf_counter() - start
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.statements += 1
+            profile.elapsed += elapsed
+            profile.shapes[statement_shape(statement)] += 1
+        if elapsed * 1000 >= self.slow_ms:
+            self.slow_statements += 1
+            logger.warning(
+                "SQL lenta (%.1f ms): %s | parámetros: %.*s",
+                elapsed * 1000, _WHITESPACE.sub(" ", statement), SQL_LOG_PARAMS_CHARS, repr(parameters)
+            )
+
+    def _engines(self):
+        return [getattr(db_engine, "sync_engine", db_engine) for db_engine in pool_engines().values()]
+
+    def enable(self, slow_ms: float = None, repeat_threshold: int = None):
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if repeat_threshold is not None:
+            self.repeat_threshold = repeat_threshold
+        if self.enabled:
+            return
+        for sync_engine in self._engines():
+            event.listen(sync_engine, "before_cursor_execute", self._before)
+            event.listen(sync_engine, "after_cursor_execute", self._after)
+        self.enabled = True
+        logger.info("Perfilado de SQL activado (lenta: %s ms, repetidas: %s)", self.slow_ms, self.repeat_threshold)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for sync_engine in self._engines():
+            event.remove(sync_engine, "before_cursor_execute", self._before)
+            event.remove(sync_engine, "after_cursor_execute", self._after)
+        self.enabled = False
+        logger.info("Perfilado de SQL desactivado")
+
+    def report(self, label: str, profile: RequestProfile):
+        """Avisa de las formas de sentencia repetidas en un request"""
+        repeated = [(shape, count) for shape, count in profile.shapes.most_common() if count > self.repeat_threshold]
+        if not repeated:
+            return
+        self.repeated_requests += 1
+        for shape, count in repeated:
+            logger.warning(
+                "Posible N+1 en %s: %d ejecuciones de %s (%d sentencias, %.1f ms en SQL en el request)",
+                label, count, shape, profile.statements, profile.elapsed * 1000
+            )
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_ms,
+            "repeat_threshold": self.repeat_threshold,
+            "slow_statements": self.slow_statements,
+            "repeated_requests": self.repeated_requests
+        }
+
+
+sql_profiler = SQLProfiler()
+
+
+class SQLProfilingMiddleware:
+    """Abre un RequestProfile por request mientras el perfilado está activo"""
+
+    def __init__(self, app, profiler: SQLProfiler = sql_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_profile.reset(token)
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            self.profiler.report(f"{scope['method']} {route}", profile)
@@ -0,0 +1,75 @@
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Attendance, AttendanceSummary, Enrollment, Student, Subject
+
+# Consultas compartidas por las rutas de materias, listas y reportes.
+# Cada función arma una sola sentencia con joins y columnas explícitas: el número
+# de consultas de una ruta no depende de cuántos alumnos tenga la materia. Las
+# relaciones de los modelos son lazy="raise", así que ninguna consulta de aquí las
+# usa y una carga fila por fila falla en lugar de pasar desapercibida.
+
+
+async def get_owned_subject(db: AsyncSession, subject_id: int, user_id: int) -> Subject:
+    """Materia del profesor; 404 si no existe o es de otro profesor"""
+    subject = await db.scalar(
+        select(Subject)
+        .filter(
+            Subject.id == subject_id,
+            Subject.id_maestro == user_id
+        )
+    )
+    if subject is None:
+        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    return subject
+
+
+def roster_statement(subject_id: int):
+    """Dueño y versión de la materia con una fila por alumno matriculado.
+
+    Outer join desde la materia: una materia sin alumnos regresa una fila con
+    las columnas del alumno en NULL, y una que no existe no regresa filas."""
+    return (
+        select(
+            Subject.id_maestro,
+            Subject.version,
+            Student.id,
+            Student.numero_control,
+            Student.nombre,
+            Student.apellido,
+            Student.foto_url,
+            Student.foto_clave,
+            Student.foto_variantes,
+            Enrollment.id
+        )
+        .outerjoin(Enrollment, Enrollment.id_materia == Subject.id)
+        .outerjoin(Student, Student.id == Enrollment.id_alumno)
+        .filter(Subject.id == subject_id)
+        .order_by(Enrollment.id)
+    )
+
+
+def attendance_counts_statement(subject_id: int):
+    """(id_matricula, presentes, total) de los resúmenes de la materia"""
+    return (
+        select(AttendanceSummary.id_matricula, AttendanceSummary.presentes, AttendanceSummary.total)
+        .join(Enrollment, AttendanceSummary.id_matricula == Enrollment.id)
+        .filter(Enrollment.id_materia == subject_id)
+    )
+
+
+def attendance_history_statement(subject_id: int):
+    """Historial de asistencias con los datos del alumno en un solo join"""
+    return (
+        select(
+            Student.id,
+            Student.nombre,
+            Student.apellido,
+            Attendance.fecha,
+            Attendance.presente,
+            Attendance.id
+        )
+        .join(Enrollment, Student.id == Enrollment.id_alumno)
+        .join(Attendance, Enrollment.id == Attendance.id_matricula)
+        .filter(Enrollment.id_materia == subject_id)
+    )
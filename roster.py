@@ -0,0 +1,81 @@
+import os
+from collections import namedtuple
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import TTLCache
+from database import Subject
+from repository import roster_statement
+
+# Caché de la lista de alumnos de cada materia.
+# La lista se lee en cada pase de lista, en las dos rutas de matrículas y en el
+# resumen de asistencias. Se guarda por materia con el dueño y la versión de la
+# materia. Las escrituras que cambian la lista (matrículas, bajas, cambios a
+# alumnos o a la materia) suben Subject.version y la invalidan después del commit,
+# pero solo en su propio worker: por eso toda lectura compara la versión de la
+# caché con la de la base (una consulta por llave primaria) antes de usarla.
+
+ROSTER_CACHE_SIZE = int(os.getenv("ROSTER_CACHE_SIZE", "512"))
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", "60"))
+
+roster_cache = TTLCache(maxsize=ROSTER_CACHE_SIZE, ttl=ROSTER_CACHE_TTL)
+
+RosterStudent = namedtuple(
+    "RosterStudent",
+    "id numero_control nombre apellido foto_url foto_clave foto_variantes id_matricula"
+)
+
+
+class Roster:
+    """Lista de una materia en el orden en que se matricularon los alumnos"""
+
+    __slots__ = ("id", "id_maestro", "version", "students", "enrollment_ids")
+
+    def __init__(self, id: int, id_maestro: int, version: int, students: tuple):
+        self.id = id
+        self.id_maestro = id_maestro
+        self.version = version  # Subject.version al leer la lista (ETags)
+        self.students = students
+        self.enrollment_ids = {student.id: student.id_matricula for student in students}
+
+
+async def load_roster(db: AsyncSession, subject_id: int):
+    """Lee la materia y su lista en una sola consulta y la guarda en la caché"""
+    rows = (await db.execute(roster_statement(subject_id))).all()
+    if not rows:
+        return None
+    roster = Roster(
+        id=subject_id,
+        id_maestro=rows[0][0],
+        version=rows[0][1],
+        students=tuple(RosterStudent(*row[2:]) for row in rows if row[2] is not None)
+    )
+    roster_cache.set(subject_id, roster)
+    return roster
+
+
+async def get_roster(db: AsyncSession, subject_id: int, user_id: int, version: int) -> Roster:
+    """Lista de una materia del profesor; 404 si no existe o es de otro profesor.
+
+    La lista en caché solo se usa si corresponde a ``version`` (de una Subject
+    recién leída); si no, se vuelve a leer."""
+    roster = roster_cache.get(subject_id)
+    if roster is None or roster.version != version:
+        roster = await load_roster(db, subject_id)
+    if roster is None or roster.id_maestro != user_id:
+        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    return roster
+
+
+async def get_current_roster(db: AsyncSession, subject_id: int, user_id: int) -> Roster:
+    """get_roster para las rutas que no leen la materia: consulta solo su versión"""
+    version = await db.scalar(select(Subject.version).filter(Subject.id == subject_id))
+    if version is None:
+        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    return await get_roster(db, subject_id, user_id, version)
+
+
+def invalidate_rosters(*subject_ids: int):
+    """Se llama después del commit de cualquier escritura que cambie la lista"""
+    for subject_id in subject_ids:
+        roster_cache.invalidate(subject_id)
@@ -1,13 +1,14 @@
 from datetime import timedelta
 from fastapi.responses import JSONResponse
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from database import get_db, User, UserCreate, UserResponse
-from utils import create_access_token, get_password_hash, verify_password
+from database import get_async_db, User, UserCreate, UserResponse
+from utils import create_access_token
+from hashing import password_hasher
+from oauth import invalidate_principal
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 session_router = APIRouter()
 
 SECRET_KEY = ""
@@ -19,20 +20,19 @@ class LoginRequest(BaseModel):
     contraseña: str
 
 @session_router.post("/register", response_model=UserResponse, tags=['Session'])
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.usuario == user.usuario).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing_user = await db.scalar(select(User).filter(User.usuario == user.usuario))
     if existing_user:
         raise HTTPException(status_code=400, detail="Nombre de usuario ya registrado")
 
-    hashed_password = get_password_hash(user.contraseña)
+    hashed_password = await password_hasher.hash(user.contraseña)
     new_user = User(
         nombre=user.nombre,
         usuario=user.usuario,
         contraseña=hashed_password
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
 
     return UserResponse(
         id=new_user.id,
@@ -41,13 +41,19 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     )
 
 @session_router.post("/login", response_model=UserResponse, tags=['Session'])
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.usuario == request.usuario).first()
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).filter(User.usuario == request.usuario))
     if not user:
         raise HTTPException(status_code=400, detail="El usuario no existe")
 
-    if not verify_password(request.contraseña, user.contraseña):
+    valid, new_hash = await password_hasher.verify(request.contraseña, user.contraseña)
+    if not valid:
         raise HTTPException(status_code=400, detail="Contraseña incorrecta")
+    if new_hash:
+        # El hash usa parámetros viejos: se guarda con la configuración actual
+        user.contraseña = new_hash
+        await db.commit()
+        invalidate_principal(user.usuario)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -81,3 +87,7 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
         nombre=user.nombre,
         usuario=user.usuario
     )
+
+@session_router.get("/hashing/stats", tags=['Session'])
+async def hashing_stats():
+    return password_hasher.stats()
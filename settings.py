@@ -0,0 +1,47 @@
+import os
+from database import to_async_url
+
+# Configuración de una instancia de la app para create_app().
+# Lo que no se pasa se lee de las variables de entorno de siempre al crear Settings,
+# no al importar este módulo; las pruebas y los benchmarks pasan los suyos (otra
+# base, backend de fotos "fake").
+
+DEFAULT_CORS_ORIGINS = (
+    "http://localhost:3000,"
+    "http://localhost:8000,"
+    "https://retzius-web.vercel.app,"
+    "https://regzusapi.onrender.com,"
+    "http://127.0.0.1:3000"
+)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").lower() in ("1", "true", "yes")
+
+
+class Settings:
+    def __init__(
+        self,
+        database_url: str = None,  # Por omisión DATABASE_URL
+        async_database_url: str = None,  # Por omisión ASYNC_DATABASE_URL o la de database_url
+        replica_url: str = None,  # Por omisión DATABASE_REPLICA_URL; "" sin réplica
+        photo_backend: str = None,  # Por omisión PHOTO_BACKEND
+        cors_origins: list = None,  # Por omisión CORS_ORIGINS
+        sql_profiling: bool = None,  # Por omisión SQL_PROFILING
+        warm_connections: int = None  # Conexiones abiertas por pool antes de aceptar tráfico
+    ):
+        if database_url is None:
+            database_url = os.getenv("DATABASE_URL", "")
+            async_database_url = async_database_url or os.getenv("ASYNC_DATABASE_URL")
+        self.database_url = database_url
+        self.async_database_url = async_database_url or to_async_url(database_url)
+        self.replica_url = os.getenv("DATABASE_REPLICA_URL", "") if replica_url is None else replica_url
+        self.photo_backend = photo_backend or os.getenv("PHOTO_BACKEND", "cloudinary")
+        if cors_origins is None:
+            cors_origins = os.getenv("CORS_ORIGINS", DEFAULT_CORS_ORIGINS).split(",")
+        self.cors_origins = list(cors_origins)
+        self.sql_profiling = _env_flag("SQL_PROFILING") if sql_profiling is None else sql_profiling
+        if warm_connections is None:
+            pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+            warm_connections = int(os.getenv("DB_WARM_CONNECTIONS", str(min(pool_size, 2))))
+        self.warm_connections = warm_connections
@@ -0,0 +1,266 @@
+import asyncio
+import functools
+import os
+import posixpath
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+# Backends de almacenamiento de fotos.
+# Todos guardan archivos por clave de contenido ("<sha256>.<ext>"): la misma foto
+# se guarda una sola vez y guardar de nuevo una clave existente no hace nada.
+
+# Configuración (se puede ajustar por variables de entorno)
+PHOTO_MAX_WORKERS = int(os.getenv("PHOTO_MAX_WORKERS", "8"))
+PHOTO_MAX_CONCURRENCY = int(os.getenv("PHOTO_MAX_CONCURRENCY", str(PHOTO_MAX_WORKERS)))
+PHOTO_TIMEOUT_SECONDS = float(os.getenv("PHOTO_TIMEOUT_SECONDS", "30"))
+PHOTO_LOCAL_ROOT = os.getenv("PHOTO_LOCAL_ROOT", "static/fotos")
+PHOTO_LOCAL_URL = os.getenv("PHOTO_LOCAL_URL", "/static/fotos")
+
+
+class PhotoStorage:
+    """Interfaz común de los backends de fotos"""
+
+    async def save(self, key: str, data: bytes, content_type: str) -> str:
+        """Guarda el archivo si no existe y regresa su URL pública"""
+        raise NotImplementedError
+
+    async def read(self, key: str) -> bytes:
+        """Contenido de un archivo guardado; 404 si no existe"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def delete_legacy(self, path: str):
+        """Borra una foto anterior a las claves por contenido; solo existían en Cloudinary"""
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalPhotoStorage(PhotoStorage):
+    """Archivos en disco servidos por la app en /static"""
+
+    def __init__(self, root: str = PHOTO_LOCAL_ROOT, base_url: str = PHOTO_LOCAL_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def _relative(self, key: str) -> str:
+        # Subcarpetas por prefijo para no juntar miles de archivos en un directorio
+        return f"{key[:2]}/{key}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *self._relative(key).split("/"))
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{self._relative(key)}"
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escritura atómica: nunca se sirve un archivo a medio escribir
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as file:
+            return file.read()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def save(self, key: str, data: bytes, content_type: str) -> str:
+        path = self.path(key)
+        if not os.path.exists(path):
+            try:
+                await asyncio.to_thread(self._write, path, data)
+            except OSError as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error al guardar la imagen: {str(e)}"
+                )
+        return self.url(key)
+
+    async def read(self, key: str) -> bytes:
+        try:
+            return await asyncio.to_thread(self._read, self.path(key))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="La imagen no existe")
+        except OSError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al leer la imagen: {str(e)}"
+            )
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._remove, self.path(key))
+
+
+class CloudinaryPhotoStorage(PhotoStorage):
+    def __init__(
+        self,
+        max_workers: int = PHOTO_MAX_WORKERS,
+        max_concurrency: int = PHOTO_MAX_CONCURRENCY,
+        timeout: float = PHOTO_TIMEOUT_SECONDS
+    ):
+        # El SDK se importa solo si se usa este backend: no alarga el arranque de los demás
+        import cloudinary
+        cloudinary.config(
+           cloud_name='',
+           api_key='',
+           api_secret=''
+        )
+        self.base_folder = "alumnos"  # Carpeta base para todos los alumnos
+        self.timeout = timeout
+        # Las llamadas del SDK son bloqueantes: se ejecutan en un pool propio
+        # para no congelar el event loop ni ocupar el threadpool de FastAPI
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="cloudinary"
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        """Ejecuta una llamada bloqueante del SDK con límite de concurrencia y timeout"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs)),
+                timeout=self.timeout
+            )
+
+    def close(self):
+        """Libera los hilos del pool"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _public_id(self, key: str) -> str:
+        return f"{self.base_folder}/{posixpath.splitext(key)[0]}"
+
+    # Llamadas bloqueantes al SDK; benchmarks/fake_cloudinary.py las reemplaza
+    def _upload(self, data: bytes, public_id: str) -> dict:
+        import cloudinary.uploader
+        # overwrite=False: si la foto ya existe Cloudinary regresa la existente
+        return cloudinary.uploader.upload(data, public_id=public_id, overwrite=False)
+
+    def _destroy(self, public_id: str):
+        import cloudinary.uploader
+        return cloudinary.uploader.destroy(public_id)
+
+    def _fetch(self, public_id: str) -> bytes:
+        import cloudinary.utils
+        url, _ = cloudinary.utils.cloudinary_url(public_id, secure=True)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise FileNotFoundError(public_id)
+            raise
+
+    async def save(self, key: str, data: bytes, content_type: str) -> str:
+        try:
+            result = await self._run(self._upload, data, self._public_id(key))
+            return result['secure_url']
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail="Tiempo de espera agotado al subir la imagen"
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al subir la imagen: {str(e)}"
+            )
+
+    async def read(self, key: str) -> bytes:
+        try:
+            return await self._run(self._fetch, self._public_id(key))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="La imagen no existe")
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail="Tiempo de espera agotado al descargar la imagen"
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al descargar la imagen: {str(e)}"
+            )
+
+    async def delete(self, key: str):
+        await self._destroy_public_id(self._public_id(key))
+
+    async def delete_legacy(self, path: str):
+        # Antes la foto se subía como alumnos/<numero_control> y se copiaba a cada materia
+        await self._destroy_public_id(f"{self.base_folder}/{path}")
+
+    async def _destroy_public_id(self, public_id: str):
+        try:
+            await self._run(self._destroy, public_id)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail="Tiempo de espera agotado al eliminar la imagen"
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al eliminar la imagen: {str(e)}"
+            )
+
+
+class MemoryPhotoStorage(PhotoStorage):
+    """Backend en memoria para pruebas y desarrollo sin red.
+
+    ``fail_times`` hace que las primeras N operaciones fallen."""
+
+    def __init__(self, fail_times: int = 0):
+        self.files = {}
+        self.fail_times = fail_times
+        self.calls = []
+
+    def _maybe_fail(self, operation: str):
+        self.calls.append(operation)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise HTTPException(
+                status_code=500,
+                detail=f"Fallo simulado en {operation}"
+            )
+
+    async def save(self, key: str, data: bytes, content_type: str) -> str:
+        self._maybe_fail("save")
+        self.files.setdefault(key, data)
+        return f"memory://{key}"
+
+    async def read(self, key: str) -> bytes:
+        self._maybe_fail("read")
+        if key not in self.files:
+            raise HTTPException(status_code=404, detail="La imagen no existe")
+        return self.files[key]
+
+    async def delete(self, key: str):
+        self._maybe_fail("delete")
+        self.files.pop(key, None)
+
+
+def create_storage(backend: str) -> PhotoStorage:
+    if backend == "local":
+        return LocalPhotoStorage()
+    if backend == "fake":
+        return MemoryPhotoStorage()
+    if backend == "cloudinary":
+        return CloudinaryPhotoStorage()
+    raise ValueError(f"Backend de fotos desconocido: {backend}")
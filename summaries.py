@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+from typing import Optional
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, Attendance, AttendanceSummary, Enrollment, Subject
+from etags import bump_subject_version
+
+# Resúmenes de asistencia por matrícula (presentes / total).
+# Se mantienen de forma incremental en la misma transacción que create_attendance;
+# `python summaries.py rebuild` los recalcula desde asistencias si hay diferencias.
+
+
+def attendance_percentage(presentes: int, total: int) -> Optional[float]:
+    if not total:
+        return None
+    return round(presentes * 100 / total, 2)
+
+
+def _upsert_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT que suma los deltas a los conteos existentes"""
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(AttendanceSummary)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(AttendanceSummary)
+    else:
+        raise NotImplementedError(f"Dialecto no soportado para resúmenes: {dialect_name}")
+    return stmt.on_conflict_do_update(
+        index_elements=[AttendanceSummary.id_matricula],
+        set_={
+            "presentes": AttendanceSummary.presentes + stmt.excluded.presentes,
+            "total": AttendanceSummary.total + stmt.excluded.total
+        }
+    )
+
+
+async def apply_attendance_deltas(db: AsyncSession, deltas: dict):
+    """Aplica {id_matricula: (delta_presentes, delta_total)}; no confirma la transacción"""
+    rows = [
+        {"id_matricula": enrollment_id, "presentes": presentes, "total": total}
+        for enrollment_id, (presentes, total) in deltas.items()
+        if presentes or total
+    ]
+    if rows:
+        await db.execute(_upsert_statement(db.bind.dialect.name), rows)
+
+
+def summary_rebuild_statement(enrollment_ids):
+    """INSERT ... SELECT que recalcula los conteos de las matrículas indicadas"""
+    counts = select(
+        Attendance.id_matricula,
+        func.sum(case((Attendance.presente, 1), else_=0)),
+        func.count()
+    )\
+        .filter(Attendance.id_matricula.in_(enrollment_ids))\
+        .group_by(Attendance.id_matricula)
+    return insert(AttendanceSummary).from_select(["id_matricula", "presentes", "total"], counts)
+
+
+async def rebuild_attendance_summaries(db: AsyncSession, subject_id: int = None) -> int:
+    """Recalcula los resúmenes desde asistencias; regresa cuántas matrículas se escribieron"""
+    enrollment_ids = select(Enrollment.id)
+    if subject_id is not None:
+        enrollment_ids = enrollment_ids.filter(Enrollment.id_materia == subject_id)
+
+    await db.execute(
+        delete(AttendanceSummary)
+        .where(AttendanceSummary.id_matricula.in_(enrollment_ids))
+    )
+    result = await db.execute(summary_rebuild_statement(enrollment_ids))
+    # Los conteos cambiaron: los ETags de los reportes ya emitidos dejan de servir
+    if subject_id is not None:
+        await bump_subject_version(db, subject_id)
+    else:
+        await db.execute(
+            update(Subject)
+            .values(version=Subject.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return result.rowcount
+
+
+async def _rebuild(subject_id: int = None):
+    async with AsyncSessionLocal() as db:
+        rows = await rebuild_attendance_summaries(db, subject_id)
+    print(f"Resúmenes reconstruidos: {rows} matrículas")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de resúmenes de asistencia")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recalcula los resúmenes desde asistencias")
+    rebuild_parser.add_argument("--subject", type=int, default=None, help="Solo esta materia")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        asyncio.run(_rebuild(args.subject))
@@ -1,29 +1,17 @@
-from passlib.context import CryptContext
 from jose import jwt
+from sqlalchemy import select
 from datetime import datetime, timedelta
 import os
-import requests
 from database import User
 
-# Configuración para la codificación de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # Clave secreta y algoritmo para JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 7 * 24 * 60  # 7 días
 
 # Función para obtener el usuario por nombre de usuario
-def get_user_by_username(usuario: str, db):
-    return db.query(User).filter(User.usuario == usuario).first()
-
-# Función para hashear contraseñas
-def get_password_hash(contraseña: str):
-    return pwd_context.hash(contraseña)
-
-# Verificar contraseña
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_user_by_username(usuario: str, db):
+    return await db.scalar(select(User).filter(User.usuario == usuario))
 
 # Generar token de acceso
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -35,10 +23,14 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Decodificar y validar un token de JWT; lanza jwt.JWTError si no es válido
+def decode_token(token: str) -> dict:
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
 # Verificar token de JWT
 def verify_token(token: str, credentials_exception):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         usuario: str = payload.get("sub")
         if usuario is None:
             raise credentials_exception